@@ -9,12 +9,24 @@ def create_app():
     app = Flask(__name__)
     CORS(app)
 
+    # Компактный JSON без экранирования кириллицы, через orjson, если он установлен
+    from .json_provider import FastJSONProvider
+    app.json = FastJSONProvider(app)
+
     # Конфигурация
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///app_new.db'
+    # DATABASE_URL переопределяет базу, например временной SQLite в тестах
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///app_new.db')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-fallback-key')
     app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'dev-jwt-fallback')
     app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(days=7)
+    # numpy - расчёт в процессе, parallel - шарды в пуле процессов для больших каталогов,
+    # sql - расчёт и сортировка в SQLite через JSON1
+    app.config['FEED_SCORING_BACKEND'] = os.environ.get('FEED_SCORING_BACKEND', 'numpy')
+    # Окно накопления лайков и регистраций перед записью метрик, секунды (0 - писать сразу)
+    app.config['METRICS_FLUSH_INTERVAL'] = float(os.environ.get('METRICS_FLUSH_INTERVAL', 2.0))
+    # Как часто воркер сверяет версию каталога постов с базой, секунды (0 - на каждом запросе)
+    app.config['CATALOG_CHECK_INTERVAL'] = float(os.environ.get('CATALOG_CHECK_INTERVAL', 1.0))
 
     # инициализация расширений
     db.init_app(app)
@@ -25,6 +37,12 @@ def create_app():
     from .routes import bp as api_bp  # локальный импорт
     app.register_blueprint(api_bp, url_prefix='')
 
+    from .metrics_queue import queue as metrics_queue
+    metrics_queue.init_app(app)
+
+    from .catalog import catalog
+    catalog.init_app(app)
+
 
 
     # Импорт моделей (если нужно их инициализировать/зарегистрировать метаданные)
@@ -0,0 +1,120 @@
+"""Замеры и сверка бэкендов ранжирования (manage.py --bench-ranking)
+и замер кодирования ответов (manage.py --bench-json)"""
+
+import json
+import time
+
+from . import feed
+from . import serializers
+from .catalog import catalog
+from .extensions import db
+from .models import User, PostEvent, PostSimple
+from .scoring import ScoringEngine, projected_rows, catalog_signature, SCORE_DECIMALS
+from .sql_scoring import SqlScoringEngine
+
+
+def reference_ranking(user):
+    """Исходный алгоритм: calculate_relevance_score по каждому посту
+
+    Затем полная сортировка всех постов.
+    """
+    posts = (PostEvent.query.order_by(PostEvent.id).all()
+             + PostSimple.query.order_by(PostSimple.id).all())
+    scored = [
+        (('event' if isinstance(post, PostEvent) else 'post', post.id),
+         round(post.calculate_relevance_score(user), SCORE_DECIMALS))
+        for post in posts
+    ]
+    scored.sort(key=lambda item: item[1], reverse=True)
+    return scored
+
+
+def _timed(fn, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.perf_counter() - started) / repeat * 1000
+
+
+def _matches(ranking, reference):
+    if len(ranking) != len(reference):
+        return False
+    return all(
+        key == ref_key and abs(score - ref_score) < 1e-9
+        for (key, score), (ref_key, ref_score) in zip(ranking, reference)
+    )
+
+
+def bench_ranking(app, user_id=None, repeat=20, limit=20):
+    """Сравнивает исходный расчёт, numpy-движок и SQL-бэкенд на одном пользователе"""
+    with app.app_context():
+        user = db.session.get(User, user_id) if user_id else User.query.first()
+        if user is None:
+            print("❌ Пользователь не найден")
+            return
+
+        signature = catalog_signature()
+        total = len(catalog)
+        print(f"📊 Пользователь {user.id}, постов в каталоге: {total}, "
+              f"повторов: {repeat}")
+
+        reference, reference_ms = _timed(lambda: reference_ranking(user), repeat)
+
+        numpy_engine, build_ms = _timed(lambda: ScoringEngine(projected_rows()), 1)
+        numpy_ranking, numpy_ms = _timed(lambda: numpy_engine.top(user, limit), repeat)
+
+        sql_engine = SqlScoringEngine.from_catalog(signature)
+        sql_ranking, sql_ms = _timed(lambda: sql_engine.top(user, limit), repeat)
+
+        print(f"   reference (calculate_relevance_score): {reference_ms:8.2f} мс")
+        print(f"   numpy (построение матрицы {build_ms:.2f} мс): {numpy_ms:8.2f} мс")
+        print(f"   sql (JSON1):                           {sql_ms:8.2f} мс")
+
+        # Сверка полного порядка и оценок с исходным алгоритмом
+        checks = {
+            'numpy': _matches(numpy_engine.top(user, total), reference),
+            'sql': _matches(sql_engine.top(user, total), reference),
+        }
+        for backend, ok in checks.items():
+            print(f"   паритет {backend}: {'✅ совпадает' if ok else '❌ РАСХОЖДЕНИЕ'}")
+        return checks
+
+
+def bench_json(app, user_id=None, limit=20, repeat=200):
+    """Байты и мкс на ответ ленты: стандартный jsonify Flask против FastJSONProvider"""
+    from flask.json.provider import DefaultJSONProvider
+
+    with app.app_context():
+        user = db.session.get(User, user_id) if user_id else User.query.first()
+        if user is None:
+            print("❌ Пользователь не найден")
+            return
+
+        snapshot = feed.user_snapshot(user, depth=limit)
+        payload = {
+            "posts": serializers.serialize_page(snapshot.page(0, limit)),
+            "count": limit,
+            "total": len(snapshot),
+            "offset": 0,
+            "limit": limit,
+            "has_more": len(snapshot) > limit,
+            "next_cursor": None
+        }
+
+        # Прежнее поведение: экранирование кириллицы, компактный вывод вне debug
+        default_provider = DefaultJSONProvider(app)
+        providers = (
+            ('flask json', lambda: default_provider.dumps(
+                payload, separators=(',', ':')).encode('utf-8')),
+            (f'fast ({app.json.backend})', lambda: app.json.dumps_bytes(payload)),
+        )
+        print(f"📊 Ответ ленты: {limit} постов, повторов: {repeat}")
+        for name, encode in providers:
+            body, elapsed_ms = _timed(encode, repeat)
+            print(f"   {name:14} {len(body):8d} байт {elapsed_ms * 1000:9.1f} мкс")
+
+        # Ответ должен разбираться в те же данные
+        same = (json.loads(app.json.dumps_bytes(payload))
+                == json.loads(default_provider.dumps(payload)))
+        print(f"   {'✅ данные совпадают' if same else '❌ РАСХОЖДЕНИЕ'}")
+        return same
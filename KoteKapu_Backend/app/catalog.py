@@ -0,0 +1,204 @@
+"""Каталог постов в памяти воркера с отслеживанием изменений по catalog_version
+
+Каталог загружается один раз; любая запись поста через ORM (create_event,
+init_db и т.д.) добавляет строку в catalog_change, номер которой и есть
+новая catalog_version. Когда версия в базе уходит вперёд, перечитываются
+только изменившиеся посты по id. Версия в базе проверяется не чаще раза в
+CATALOG_CHECK_INTERVAL секунд, а после записей этого воркера - сразу,
+поэтому в установившемся режиме лента не делает запросов к каталогу.
+"""
+
+import json
+import threading
+import time
+from array import array
+
+from sqlalchemy import event
+
+from . import tags
+from .extensions import db
+from .models import PostEvent, PostSimple, CatalogChange
+
+# Как часто сверять catalog_version с базой, секунды; 0 - на каждом запросе
+CHECK_INTERVAL = 1.0
+
+# Столбцы, от которых зависит ранжирование: изменения остальных каталог не трогают
+CATALOG_COLUMNS = ('interest_tags', 'format_tags', 'event_type')
+
+MODELS = (('event', PostEvent), ('post', PostSimple))
+
+
+class PostRecord:
+    """Лёгкая запись поста: теги - array('I') id из tags.vocabulary
+
+    Строки тегов не хранятся, тип события - тоже id тега (или None).
+    Имена по id возвращает tags.vocabulary.names().
+    """
+    __slots__ = ('kind', 'id', 'interest_tags', 'format_tags', 'event_type')
+
+    def __init__(self, kind, post_id, interest_tags, format_tags, event_type):
+        self.kind = kind
+        self.id = post_id
+        self.interest_tags = interest_tags
+        self.format_tags = format_tags
+        self.event_type = event_type
+
+    @property
+    def key(self):
+        return self.kind, self.id
+
+    def row(self):
+        """Строка для движка ранжирования с id тегов вместо строк"""
+        return self.kind, self.id, self.interest_tags, self.format_tags, self.event_type
+
+
+def _records(kind, ids=None):
+    """Записи постов одного типа проекцией нужных столбцов; ids=None - все"""
+    model = PostEvent if kind == 'event' else PostSimple
+    event_type = model.event_type if kind == 'event' else db.literal(None)
+    query = db.session.query(model.id, model.interest_tags, model.format_tags,
+                             event_type)
+    if ids is not None:
+        query = query.filter(model.id.in_(ids))
+    rows = [(post_id, json.loads(interest_tags or '[]'),
+             json.loads(format_tags or '[]'), post_event_type)
+            for post_id, interest_tags, format_tags, post_event_type in query]
+
+    # Новые теги добавляются в словарь одним вызовом на всю пачку
+    tags.vocabulary.intern_all(sorted({tag for row in rows for tag in row[1] + row[2]}
+                                      | {row[3] for row in rows if row[3]}))
+    for post_id, interest_tags, format_tags, post_event_type in rows:
+        event_type_id = (tags.vocabulary.id_for(post_event_type)
+                         if post_event_type else None)
+        yield PostRecord(kind, post_id,
+                         array('I', tags.vocabulary.intern_all(interest_tags)),
+                         array('I', tags.vocabulary.intern_all(format_tags)),
+                         event_type_id)
+
+
+def current_version():
+    """catalog_version в базе: номер последней записи журнала"""
+    return db.session.query(db.func.max(CatalogChange.version)).scalar() or 0
+
+
+class PostCatalog:
+    """Все посты каталога в памяти процесса, обновляемые по журналу изменений"""
+
+    def __init__(self, check_interval=CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self.version = None
+        self.loads = 0
+        self.reloaded = 0
+        self.stale = True
+        self._records = {}
+        self._ordered = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.check_interval = app.config.get('CATALOG_CHECK_INTERVAL',
+                                             self.check_interval)
+
+    def __len__(self):
+        return len(self._records)
+
+    def mark_stale(self):
+        """Следующее обращение сверит версию с базой, не дожидаясь интервала"""
+        self.stale = True
+
+    def refresh(self):
+        """Подтягивает изменения каталога и возвращает его catalog_version"""
+        with self._lock:
+            now = time.monotonic()
+            if (self.version is not None and not self.stale
+                    and now - self._checked_at < self.check_interval):
+                return self.version
+            # Сбрасываем флаг до чтения версии: запись, пришедшая во время
+            # обновления, снова пометит каталог устаревшим
+            self.stale = False
+            self._checked_at = now
+
+            version = current_version()
+            if self.version is None:
+                self._records = {record.key: record for kind, _ in MODELS
+                                 for record in _records(kind)}
+                self.loads += 1
+            elif version != self.version:
+                self._reload(self.version, version)
+            else:
+                return self.version
+            self.version = version
+            self._ordered = None
+            return version
+
+    def _reload(self, since, version):
+        """Перечитывает по id посты, изменённые после версии since"""
+        changed = {kind: set() for kind, _ in MODELS}
+        changes = db.session.query(
+            CatalogChange.post_type, CatalogChange.post_id
+        ).filter(CatalogChange.version > since, CatalogChange.version <= version)
+        for post_type, post_id in changes:
+            changed[post_type].add(post_id)
+
+        for kind, ids in changed.items():
+            if not ids:
+                continue
+            for post_id in ids:
+                # Удалённые посты просто не вернутся из запроса
+                self._records.pop((kind, post_id), None)
+            for record in _records(kind, sorted(ids)):
+                self._records[record.key] = record
+            self.reloaded += len(ids)
+
+    def records(self):
+        """Записи в порядке каталога: мероприятия, затем посты, каждые по id"""
+        self.refresh()
+        with self._lock:
+            if self._ordered is None:
+                order = {kind: index for index, (kind, _) in enumerate(MODELS)}
+                self._ordered = sorted(
+                    self._records.values(),
+                    key=lambda record: (order[record.kind], record.id))
+            return self._ordered
+
+    def rows(self):
+        return [record.row() for record in self.records()]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'version': self.version,
+                'posts': len(self._records),
+                'loads': self.loads,
+                'reloaded': self.reloaded,
+                'check_interval': self.check_interval
+            }
+
+
+catalog = PostCatalog()
+
+
+def _record_change(connection, kind, post_id):
+    connection.execute(db.insert(CatalogChange).values(post_type=kind, post_id=post_id))
+    catalog.mark_stale()
+
+
+def _catalog_columns_changed(target):
+    state = db.inspect(target)
+    return any(column in state.attrs.keys()
+               and state.attrs[column].history.has_changes()
+               for column in CATALOG_COLUMNS)
+
+
+for _kind, _model in MODELS:
+    # Журнал пишется в той же транзакции, что и сам пост, при любой записи через ORM
+    @event.listens_for(_model, 'after_insert')
+    @event.listens_for(_model, 'after_delete')
+    def _on_post_written(mapper, connection, target, kind=_kind):
+        _record_change(connection, kind, target.id)
+
+    @event.listens_for(_model, 'after_update')
+    def _on_post_updated(mapper, connection, target, kind=_kind):
+        # Лайки и регистрации помечают пост изменённым, но ранжирование не трогают
+        if _catalog_columns_changed(target):
+            _record_change(connection, kind, target.id)
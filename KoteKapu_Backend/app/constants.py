@@ -10,3 +10,6 @@ EVENT_TYPES = [
 ]
 
 FORMAT_TYPES = ["онлайн", "офлайн", "гибрид"]
+
+# Сколько событий принимает один запрос POST /api/interactions/batch
+MAX_INTERACTION_BATCH = 1000
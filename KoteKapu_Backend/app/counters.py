@@ -0,0 +1,60 @@
+"""Денормализованные счётчики вовлечённости и их пересчёт (manage.py --repair-counters)
+
+likes_count и registered_count у мероприятий, subscribers_count и
+events_count у организаций меняются в той же транзакции, что и строка
+связи (лайк, регистрация, подписка, новое мероприятие), поэтому для ответа
+не нужно загружать всю коллекцию ради её длины. repair_counters сверяет их
+с таблицами связей, если записи прошли в обход эндпоинтов.
+"""
+
+from .extensions import db
+from .models import (Organisation, PostEvent, user_liked_posts, user_registered_events,
+                     user_subscriptions)
+
+
+def increment(model, instance, column, amount=1):
+    """Атомарный инкремент при ближайшем flush
+
+    Выполняется как UPDATE ... SET column = column + amount.
+    """
+    setattr(instance, column, getattr(model, column) + amount)
+
+
+def _count(table, column, owner):
+    return (db.select(db.func.count()).select_from(table).where(column == owner)
+            .scalar_subquery())
+
+
+# (модель, столбец счётчика, подзапрос с точным значением)
+COUNTERS = (
+    (PostEvent, 'likes_count',
+     _count(user_liked_posts, user_liked_posts.c.post_event_id, PostEvent.id)),
+    (PostEvent, 'registered_count',
+     _count(user_registered_events, user_registered_events.c.post_event_id,
+            PostEvent.id)),
+    (Organisation, 'subscribers_count',
+     _count(user_subscriptions, user_subscriptions.c.organization_id,
+            Organisation.id)),
+    (Organisation, 'events_count',
+     _count(PostEvent.__table__, PostEvent.organization_id, Organisation.id)),
+)
+
+COUNTER_COLUMNS = [f'{model.__tablename__}.{column}' for model, column, _ in COUNTERS]
+
+
+def repair_counters():
+    """Пересчитывает счётчики из таблиц связей
+
+    Возвращает {таблица.столбец: исправлено строк}.
+    """
+    repaired = {}
+    for model, column, exact in COUNTERS:
+        counter = getattr(model, column)
+        # Обновляем только расходящиеся строки - rowcount и есть число исправлений
+        result = db.session.execute(
+            db.update(model).where(counter != exact).values({column: exact})
+            .execution_options(synchronize_session=False)
+        )
+        repaired[f'{model.__tablename__}.{column}'] = result.rowcount
+    db.session.commit()
+    return repaired
@@ -0,0 +1,30 @@
+"""Условные GET: сильные ETag из версий строк и ответ 304 до сериализации
+
+ETag считается из updated_at (и metrics_version у пользователя) тех строк,
+от которых зависит ответ, поэтому проверка If-None-Match стоит одного
+маленького запроса, а тело строится только при промахе.
+"""
+
+import hashlib
+
+from flask import request, current_app
+
+
+def make(*parts):
+    """ETag из значений, от которых зависит тело ответа"""
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def not_modified(etag, private=False):
+    """Ответ 304, если у клиента уже есть тело с этим ETag, иначе None"""
+    # If-None-Match сравнивается слабо (RFC 9110), * совпадает с любым тегом
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    return tagged(current_app.response_class(status=304), etag, private)
+
+
+def tagged(response, etag, private=False):
+    """Проставляет ETag и требует перепроверки перед использованием кэша"""
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache' if private else 'no-cache'
+    return response
@@ -0,0 +1,378 @@
+"""Выдача ленты: частичный отбор top-k, снимки ранжирования для курсоров и кэш лент"""
+
+import base64
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+from . import scoring
+from .extensions import db
+from .models import UserFeedSnapshot
+
+# Снимок живёт 15 минут - этого хватает на пролистывание ленты
+SNAPSHOT_TTL = 15 * 60
+SNAPSHOT_CAPACITY = 512
+# Сколько различных лент (по отпечатку предпочтений) держим в памяти процесса
+FEED_CACHE_CAPACITY = 2048
+# Минимальная глубина отбора, чтобы следующие страницы не пересчитывали top-k
+SNAPSHOT_MIN_DEPTH = 100
+
+
+class FeedSnapshot:
+    """Замороженное ранжирование каталога для одного вектора предпочтений
+
+    Хранит оценки только постов-кандидатов из инвертированного индекса;
+    посты с нулевой оценкой идут после них в порядке каталога и
+    вычисляются лениво, когда страница до них доходит.
+    """
+
+    def __init__(self, keys, rows, scores, total=None):
+        self.id = uuid.uuid4().hex
+        self.keys = keys
+        self.rows = rows
+        self.scores = scores
+        self.ranked = np.zeros(0, dtype=np.intp)
+        self._unscored = None
+        # total больше len(keys) у предрасчитанного снимка, где хранится только топ
+        self.total = len(keys) if total is None else total
+        self.created_at = time.monotonic()
+
+    def __len__(self):
+        return self.total
+
+    @property
+    def partial(self):
+        """Снимок хранит только топ каталога (предрасчёт или шардированный отбор)"""
+        return self.total != len(self.keys)
+
+    def covers(self, end):
+        """Может ли снимок отдать позиции до end без пересчёта"""
+        return not self.partial or end <= len(self.rows)
+
+    @classmethod
+    def from_ranking(cls, ranking, total):
+        """Снимок из готового упорядоченного списка [(тип, id), оценка]"""
+        keys = [tuple(key) for key, _ in ranking]
+        scores = np.array([score for _, score in ranking])
+        snapshot = cls(keys, np.arange(len(keys)), scores, total)
+        snapshot.ranked = np.arange(len(keys))
+        return snapshot
+
+    def unscored(self):
+        """Строки постов с нулевой оценкой в порядке каталога"""
+        if self._unscored is None:
+            self._unscored = np.setdiff1d(np.arange(len(self.keys)), self.rows)
+        return self._unscored
+
+    def page(self, offset, limit):
+        """Список ((тип, id), оценка) для страницы"""
+        end = offset + limit
+        scored = len(self.rows)
+        result = []
+
+        if offset < scored:
+            if end > len(self.ranked) and len(self.ranked) < scored:
+                depth = max(end, 2 * len(self.ranked), SNAPSHOT_MIN_DEPTH)
+                self.ranked = scoring.top_k(self.scores, depth)
+            for index in self.ranked[offset:end]:
+                result.append((self.keys[self.rows[index]], float(self.scores[index])))
+
+        if end > scored:
+            for row in self.unscored()[max(offset - scored, 0):end - scored]:
+                result.append((self.keys[row], 0.0))
+
+        return result
+
+    def iter_from(self, position):
+        """Ленивый обход (позиция, (тип, id), оценка) в порядке выдачи
+
+        Начинается с position.
+        """
+        scored = len(self.rows)
+        while position < scored:
+            if position >= len(self.ranked):
+                depth = max(position + 1, 2 * len(self.ranked), SNAPSHOT_MIN_DEPTH)
+                self.ranked = scoring.top_k(self.scores, depth)
+            index = self.ranked[position]
+            yield position, self.keys[self.rows[index]], float(self.scores[index])
+            position += 1
+        for row in self.unscored()[position - scored:]:
+            yield position, self.keys[row], 0.0
+            position += 1
+
+    def page_unseen(self, position, limit, seen):
+        """Страница без просмотренных постов: (список, позиция следующей страницы)
+
+        Отбор топа продолжается за просмотренными постами, пока страница не
+        заполнится, поэтому позиция в курсоре - сырая позиция в снимке.
+        """
+        result = []
+        for position, key, score in self.iter_from(position):
+            if key in seen:
+                continue
+            result.append((key, score))
+            if len(result) == limit:
+                return result, position + 1
+        return result, len(self.keys)
+
+    def with_post(self, key, score):
+        """Новый снимок с добавленным постом
+
+        Текущий остаётся неизменным для курсоров.
+        """
+        row = len(self.keys)
+        if score <= 0:
+            snapshot = FeedSnapshot(self.keys + [key], self.rows, self.scores)
+            snapshot.ranked = self.ranked
+            if self._unscored is not None:
+                snapshot._unscored = np.append(self._unscored, row)
+            return snapshot
+
+        snapshot = FeedSnapshot(self.keys + [key], np.append(self.rows, row),
+                                np.append(self.scores, score))
+        # Вставляем пост в отобранный префикс после всех постов с не меньшей оценкой
+        position = int(np.count_nonzero(self.scores[self.ranked] >= score))
+        if position < len(self.ranked) or len(self.ranked) == len(self.rows):
+            snapshot.ranked = np.insert(self.ranked, position, len(self.rows))
+        else:
+            snapshot.ranked = self.ranked
+        snapshot._unscored = self._unscored
+        return snapshot
+
+
+class SnapshotStore:
+    """LRU-хранилище снимков ленты в памяти процесса"""
+
+    def __init__(self, capacity=SNAPSHOT_CAPACITY, ttl=SNAPSHOT_TTL):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, snapshot):
+        with self._lock:
+            self._items[snapshot.id] = snapshot
+            while len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+
+    def get(self, snapshot_id):
+        # Случайный id снимка сам служит ключом доступа: снимок общий для
+        # пользователей с одинаковыми предпочтениями и содержит только публичные посты
+        with self._lock:
+            snapshot = self._items.get(snapshot_id)
+            if snapshot is None or time.monotonic() - snapshot.created_at > self.ttl:
+                return None
+            self._items.move_to_end(snapshot_id)
+            return snapshot
+
+
+snapshots = SnapshotStore()
+
+
+def encode_cursor(snapshot_id, offset):
+    raw = f"{snapshot_id}:{offset}".encode('ascii')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Возвращает (id снимка, смещение) или None, если курсор повреждён"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        decoded = base64.urlsafe_b64decode(padded).decode('ascii')
+        snapshot_id, offset = decoded.split(':')
+        offset = int(offset)
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if offset < 0:
+        return None
+    return snapshot_id, offset
+
+
+class FeedCacheEntry:
+    def __init__(self, snapshot, preferences, signature):
+        self.snapshot = snapshot
+        self.preferences = preferences
+        self.signature = signature
+
+
+class FeedCache:
+    """Материализованные ленты, общие для пользователей с одинаковыми предпочтениями
+
+    Ключ - отпечаток канонизированного вектора предпочтений, поэтому после
+    онбординга тысячи пользователей с одинаковыми метриками делят одну ленту.
+    Запись пользователя меняет его отпечаток, а invalidate_user освобождает
+    ленту, если на неё больше никто не ссылается.
+    """
+
+    def __init__(self, capacity=FEED_CACHE_CAPACITY):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.patches = 0
+        self._items = OrderedDict()
+        self._owners = {}
+        self._refs = Counter()
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def _attach(self, user_id, fingerprint):
+        previous = self._owners.get(user_id)
+        if previous == fingerprint:
+            return
+        if previous is not None:
+            self._release(user_id)
+        self._owners[user_id] = fingerprint
+        self._refs[fingerprint] += 1
+
+    def _release(self, user_id):
+        fingerprint = self._owners.pop(user_id, None)
+        if fingerprint is None:
+            return None
+        self._refs[fingerprint] -= 1
+        if self._refs[fingerprint] <= 0:
+            del self._refs[fingerprint]
+            return fingerprint
+        return None
+
+    def flight(self, fingerprint):
+        """Блокировка на отпечаток: одну ленту считает один поток, остальные ждут"""
+        with self._lock:
+            return self._flights.setdefault(fingerprint, threading.Lock())
+
+    def get(self, user, signature, record=True):
+        """Снимок ленты пользователя или None, если его нужно пересчитать"""
+        fingerprint = user.get_preference_vector().fingerprint
+        with self._lock:
+            entry = self._items.get(fingerprint)
+            if entry is None or entry.signature != signature:
+                if record:
+                    self.misses += 1
+                return None
+            self.hits += 1
+            self._items.move_to_end(fingerprint)
+            self._attach(user.id, fingerprint)
+            return entry.snapshot
+
+    def put(self, user, snapshot, signature):
+        preferences = user.get_preference_vector()
+        with self._lock:
+            self._items[preferences.fingerprint] = FeedCacheEntry(
+                snapshot, preferences, signature)
+            self._items.move_to_end(preferences.fingerprint)
+            self._attach(user.id, preferences.fingerprint)
+            while len(self._items) > self.capacity:
+                fingerprint, _ = self._items.popitem(last=False)
+                self._flights.pop(fingerprint, None)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            fingerprint = self._release(user_id)
+            if (fingerprint is not None
+                    and self._items.pop(fingerprint, None) is not None):
+                self._flights.pop(fingerprint, None)
+                self.invalidations += 1
+
+    def invalidate_all(self):
+        with self._lock:
+            self.invalidations += len(self._items)
+            self._items.clear()
+            self._owners.clear()
+            self._refs.clear()
+            self._flights.clear()
+
+    def add_post(self, key, features, old_signature, signature):
+        """Досчитывает новый пост для всех закэшированных лент вместо их сброса
+
+        Патч верен, только если между версиями ровно одна запись - этот пост.
+        Иначе в каталог попали и чужие изменения, и ленты сбрасываются.
+        """
+        consecutive = signature == old_signature + 1
+        with self._lock:
+            for fingerprint, entry in list(self._items.items()):
+                # Лента, уже отставшая от каталога, одним постом не исправится,
+                # а в частичный топ пост нельзя вставить без знания хвоста
+                if (not consecutive or entry.signature != old_signature
+                        or entry.snapshot.partial):
+                    del self._items[fingerprint]
+                    self.invalidations += 1
+                    continue
+                score = scoring.score_features(features, entry.preferences)
+                entry.snapshot = entry.snapshot.with_post(key, score)
+                entry.signature = signature
+                self.patches += 1
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'size': len(self._items),
+                'capacity': self.capacity,
+                'users': len(self._owners),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / requests, 3) if requests else 0.0,
+                'invalidations': self.invalidations,
+                'patches': self.patches
+            }
+
+
+cache = FeedCache()
+
+
+def precomputed_snapshot(user, signature, depth):
+    """Снимок из user_feed_snapshot, если он свежий и достаточно глубокий"""
+    row = db.session.get(UserFeedSnapshot, user.id)
+    if row is None:
+        return None
+    if row.fingerprint != user.get_preference_vector().fingerprint:
+        return None
+    if row.catalog_signature != scoring.signature_key(signature):
+        return None
+
+    ranking = [((kind, post_id), score) for kind, post_id, score in row.get_posts()]
+    snapshot = FeedSnapshot.from_ranking(ranking, row.total)
+    return snapshot if snapshot.covers(depth) else None
+
+
+def user_snapshot(user, depth=None):
+    """Снимок ленты пользователя
+
+    Сначала общий кэш, затем предрасчёт, затем расчёт по каталогу.
+    """
+    signature = scoring.catalog_signature()
+    snapshot = cache.get(user, signature)
+    if snapshot is not None and snapshot.covers(depth or 0):
+        return snapshot
+
+    if depth is not None:
+        snapshot = precomputed_snapshot(user, signature, depth)
+        if snapshot is not None:
+            return snapshot
+
+    with cache.flight(user.get_preference_vector().fingerprint):
+        # Пока ждали блокировку, ленту с тем же отпечатком мог посчитать другой поток
+        snapshot = cache.get(user, signature, record=False)
+        if snapshot is None or not snapshot.covers(depth or 0):
+            engine = scoring.get_engine(signature)
+            if engine.top_only:
+                # Шардированный движок отдаёт сразу готовый топ нужной глубины
+                ranking = engine.top(user, max(2 * (depth or 0), SNAPSHOT_MIN_DEPTH))
+                snapshot = FeedSnapshot.from_ranking(ranking, len(engine))
+            else:
+                rows, scores = engine.score_candidates(user)
+                snapshot = FeedSnapshot(engine.keys, rows, scores)
+            cache.put(user, snapshot, signature)
+    return snapshot
+
+
+def on_post_created(post, old_signature):
+    """Добавляет только что сохранённый пост в закэшированные ленты"""
+    kind, post_id, interest_tags, format_tags, event_type = next(
+        scoring.post_rows([post]))
+    features = scoring.post_features(kind, interest_tags, format_tags, event_type)
+    cache.add_post((kind, post_id), features, old_signature,
+                   scoring.catalog_signature())
@@ -1,6 +1,8 @@
 
 from .extensions import db
 from .models import User, Achievement, Organisation, PostEvent, PostSimple
+from .schema import upgrade_schema
+from .counters import repair_counters
 from datetime import datetime, timedelta
 import json
 import traceback
@@ -13,8 +15,8 @@ def init_db(app):
 
     with app.app_context():
         try:
-            # Всегда создаем таблицы (если они не существуют)
-            db.create_all()
+            # Всегда создаем таблицы (если они не существуют) и переносим старые данные
+            upgrade_schema()
             print("✅ БАЗА ДАННЫХ ГОТОВА!")
 
             # Проверяем, нужно ли создавать тестовые данные
@@ -1040,6 +1042,9 @@ def init_db(app):
                 db.session.commit()
                 print(f"✅ СОЗДАНО {len(simple_posts)} ПРОСТЫХ ПОСТОВ!")
 
+                # Тестовые данные создаются напрямую, счётчики считаем по ним
+                repair_counters()
+
                 print("🎉 ИНИЦИАЛИЗАЦИЯ БАЗЫ ДАННЫХ УСПЕШНО ЗАВЕРШЕНА!")
             else:
                 print("📊 БАЗА ДАННЫХ УЖЕ СОДЕРЖИТ ДАННЫЕ - пропускаем инициализацию")
@@ -0,0 +1,61 @@
+"""JSON-провайдер ответов: orjson, если установлен, иначе стандартный json
+
+Ответы всегда компактные и без экранирования кириллицы (\\uXXXX раздувает
+текст в 2-3 раза). Ключи сортируются, даты и прочие типы преобразуются
+так же, как в стандартном провайдере Flask, поэтому ответ отличается от
+прежнего только отсутствием экранирования.
+"""
+
+import json
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # необязательная зависимость
+    orjson = None
+
+if orjson is not None:
+    # Даты отдаём в default провайдера, чтобы формат не зависел от кодировщика
+    ORJSON_OPTIONS = (orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+                      | orjson.OPT_PASSTHROUGH_DATETIME)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Компактный JSON в UTF-8 для всех jsonify"""
+
+    ensure_ascii = False
+    compact = True
+
+    @property
+    def backend(self):
+        return 'orjson' if orjson is not None else 'json'
+
+    def dumps_bytes(self, obj):
+        """Ответ в байтах UTF-8 без промежуточной строки, если есть orjson"""
+        if orjson is not None:
+            try:
+                return orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS)
+            except TypeError:
+                # orjson не кодирует, например, целые больше 64 бит -
+                # отдаём стандартному json
+                pass
+        return json.dumps(obj, default=self.default, ensure_ascii=False,
+                          sort_keys=self.sort_keys,
+                          separators=(',', ':')).encode('utf-8')
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and not kwargs:
+            return self.dumps_bytes(obj).decode('utf-8')
+        kwargs.setdefault('separators', (',', ':'))
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps_bytes(obj) + b'\n',
+                                        mimetype=self.mimetype)
@@ -0,0 +1,211 @@
+"""Отложенная запись сигналов взаимодействий в метрики пользователей
+
+Сигналы - лайки и регистрации на мероприятия.
+"""
+
+import atexit
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from . import feed
+from . import scoring
+from . import utils
+from .extensions import db
+from .models import User, PostEvent
+
+# Окно накопления сигналов, секунды; 0 - применять сразу в запросе
+FLUSH_INTERVAL = 2.0
+# Столько сигналов в очереди запускает сброс, не дожидаясь окна
+MAX_PENDING = 1000
+# Оптимистичные повторы при конфликте compare-and-swap и базовая пауза
+# между ними, секунды; дальше запись идёт под блокировкой до успеха
+MAX_RETRIES = 10
+RETRY_BACKOFF = 0.005
+
+
+class MetricsQueue:
+    """Очередь сигналов, которые сворачиваются в метрики пачками
+
+    Сигналы одного пользователя применяются по порядку теми же функциями,
+    что и раньше (шаг 0.1, затем нормализация), поэтому результат совпадает
+    с синхронным обновлением, а пользователь записывается один раз за окно.
+    Очередь живёт в памяти воркера: при остановке процесса она сбрасывается,
+    при аварийном падении несброшенные сигналы теряются.
+
+    Запись защищена от потерянных обновлений без блокировки таблицы: метрики
+    фиксируются, только если metrics_version не изменилась с момента чтения,
+    иначе сигналы применяются заново к свежим метрикам. Если версию раз за
+    разом успевают изменить, запись сериализуется и повторяется до успеха.
+    """
+
+    def __init__(self, interval=FLUSH_INTERVAL, max_pending=MAX_PENDING):
+        self.interval = interval
+        self.max_pending = max_pending
+        self.app = None
+        self.signals = 0
+        self.flushes = 0
+        self.writes = 0
+        self.errors = 0
+        self.retries = 0
+        self.serialized = 0
+        self._pending = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = app.config.get('METRICS_FLUSH_INTERVAL', self.interval)
+        atexit.register(self.flush)
+
+    def push(self, user_id, post, interests=False, feed_action=None):
+        """Ставит в очередь сигнал: обновить интересы и/или метрики ленты по посту"""
+        kind = 'event' if isinstance(post, PostEvent) else 'post'
+        with self._lock:
+            self._pending.setdefault(user_id, []).append(
+                (kind, post.id, interests, feed_action))
+            self._size += 1
+            self.signals += 1
+            full = self._size >= self.max_pending
+
+        if not self.interval:
+            self.flush()
+            return
+        self._ensure_worker()
+        if full:
+            self._wakeup.set()
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='metrics-flush',
+                                                daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def _write(self, user_id, mutate, lock_row=False):
+        """Одна попытка read-modify-write
+
+        True - записано, False - версию успели изменить, None - пользователя нет.
+        """
+        # FOR UPDATE держит строку до коммита там, где база это умеет
+        # (в SQLite запись и так сериализована)
+        user = db.session.get(User, user_id, with_for_update=lock_row)
+        if user is None:
+            return None
+        expected = user.metrics_version
+        with db.session.no_autoflush:
+            user.apply_decay()
+            mutate(user)
+
+        # Сначала версия, потом строки весов: выигравшая запись держит
+        # блокировку до коммита, проигравшая не дойдёт до вставки тех же тегов
+        swapped = db.session.connection().execute(
+            db.update(User)
+            .where(User.id == user_id, User.metrics_version == expected)
+            .values(metrics_version=expected + 1)
+        ).rowcount == 1
+        if swapped:
+            db.session.commit()
+            return True
+
+        # Метрики успел изменить другой воркер - откатываем и читаем заново
+        db.session.rollback()
+        with self._lock:
+            self.retries += 1
+        return False
+
+    def update(self, user_id, mutate):
+        """Read-modify-write метрик: mutate(user) с compare-and-swap по metrics_version
+
+        После MAX_RETRIES неудачных оптимистичных попыток запись идёт по
+        одной за раз в процессе и с блокировкой строки и повторяется, пока
+        не пройдёт, поэтому сигналы не теряются из-за конфликтов версий.
+        Возвращает False, только если пользователя уже нет.
+        """
+        for attempt in range(MAX_RETRIES):
+            written = self._write(user_id, mutate)
+            if written is not False:
+                return bool(written)
+            time.sleep(random.uniform(0, RETRY_BACKOFF * 2 ** attempt))
+
+        with self._lock:
+            self.serialized += 1
+        with self._write_lock:
+            written = self._write(user_id, mutate, lock_row=True)
+            attempt = 0
+            while written is False:
+                # Конкурировать могут лишь другие процессы и уже начатые
+                # оптимистичные попытки, поэтому пауза больше не растёт
+                backoff = RETRY_BACKOFF * 2 ** min(attempt, MAX_RETRIES)
+                time.sleep(random.uniform(0, backoff))
+                attempt += 1
+                written = self._write(user_id, mutate, lock_row=True)
+        return bool(written)
+
+    def apply(self, user_id, signals):
+        """Применяет сигналы пользователя по порядку одной записью"""
+        def replay(user):
+            posts = scoring.load_posts(
+                [(kind, post_id) for kind, post_id, _, _ in signals])
+            for kind, post_id, interests, feed_action in signals:
+                post = posts.get((kind, post_id))
+                if post is None:
+                    continue
+                if interests:
+                    utils.update_user_interests(user, post)
+                if feed_action:
+                    user.update_feed_metrics(post, feed_action)
+
+        return self.update(user_id, replay)
+
+    def flush(self):
+        """Применяет накопленные сигналы: одна запись на пользователя"""
+        if self.app is None:
+            return 0
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, OrderedDict()
+                self._size = 0
+            if not pending:
+                return 0
+
+            with self.app.app_context():
+                for user_id, signals in pending.items():
+                    try:
+                        if self.apply(user_id, signals):
+                            self.writes += 1
+                    except Exception as e:
+                        db.session.rollback()
+                        self.errors += 1
+                        print(f"ERROR: Ошибка при обновлении метрик "
+                              f"пользователя {user_id}: {e}")
+                    feed.cache.invalidate_user(user_id)
+            self.flushes += 1
+            return len(pending)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': self._size,
+                'interval': self.interval,
+                'signals': self.signals,
+                'flushes': self.flushes,
+                'writes': self.writes,
+                'errors': self.errors,
+                'retries': self.retries,
+                'serialized': self.serialized
+            }
+
+
+queue = MetricsQueue()
@@ -1,8 +1,57 @@
 from .extensions import db, bcrypt
 import json
 from datetime import datetime, timedelta
+from sqlalchemy import event
+from sqlalchemy.orm import Session
 from .extensions import db
 from . import utils
+from .preferences import UserPreferenceVector, FEED_PREFERENCE_DIMENSIONS, decay_steps, decay_weights
+
+# Начальные метрики нового пользователя
+DEFAULT_INTERESTS_METRICS = {
+    'IT': 0.1, 'искусства': 0.1, 'музыка': 0.1, 'языки': 0.1,
+    'экономика': 0.1, 'менеджмент': 0.1, 'творчество': 0.1,
+    'спорт': 0.1, 'инжинерия': 0.1, 'культура': 0.1
+}
+DEFAULT_FORMAT_METRICS = {'онлайн': 0.33, 'офлайн': 0.33, 'гибрид': 0.34}
+DEFAULT_FEED_METRICS = {
+    'click_rate': 0.0,
+    'like_rate': 0.0,
+    'time_spent': 0.0,
+    'completion_rate': 0.0,
+    'preferred_categories': {},
+    'preferred_formats': {},
+    'preferred_event_types': {}
+}
+
+# Измерения user_tag_weight для метрик ленты: счётчики хранятся
+# в измерении 'feed' (тег - имя счётчика), словари - каждый в своём
+FEED_STATS_DIMENSION = 'feed'
+FEED_STATS = ('click_rate', 'like_rate', 'time_spent', 'completion_rate')
+# Измерения, веса которых затухают со временем (см. preferences.decay_weights)
+DECAYED_DIMENSIONS = ('interests', 'formats', 'event_types') + FEED_PREFERENCE_DIMENSIONS
+
+# Ответы анкеты хранятся отдельно от обучаемых весов: с них начинается
+# пересборка метрик из истории (manage.py --rebuild-metrics)
+SURVEY_DIMENSIONS = {'interests': 'survey_interests', 'formats': 'survey_formats', 'event_types': 'survey_event_types'}
+
+# Взаимодействия из interaction_log и счётчики ленты, которые они двигают;
+# показы только журналируются (для будущего расчёта CTR)
+INTERACTION_TYPES = ('impression', 'click', 'dwell', 'completion')
+FEED_STAT_ACTIONS = {'click': 'click_rate', 'dwell': 'time_spent', 'completion': 'completion_rate'}
+
+
+def split_feed_metrics(metrics_dict):
+    """Раскладывает словарь feed_metrics по измерениям: {измерение: {тег: вес}}"""
+    dimensions = {FEED_STATS_DIMENSION: {}}
+    dimensions.update({dimension: {} for dimension in FEED_PREFERENCE_DIMENSIONS})
+    for name, value in metrics_dict.items():
+        if isinstance(value, dict):
+            dimensions[name] = dict(value)
+        else:
+            dimensions[FEED_STATS_DIMENSION][name] = value
+    return dimensions
+
 
 class Achievement(db.Model):
     __tablename__ = 'achievement'
@@ -19,6 +68,8 @@ class Organisation(db.Model):
     title = db.Column(db.String(250), unique=True, nullable=False)
     description = db.Column(db.String(1000), nullable=False)
     created_at = db.Column(db.DateTime, server_default=db.func.now())
+    # Время последнего изменения строки - из него строится ETag (см. etags.py)
+    updated_at = db.Column(db.DateTime, nullable=True, default=datetime.now, onupdate=datetime.now)
     avatar = db.Column(db.String(500), nullable=True)
     owner_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     status = db.Column(db.String(20), default='pending')  # pending, approved, rejected
@@ -26,6 +77,10 @@ class Organisation(db.Model):
     social_links = db.Column(db.Text, default='[]')
     tags = db.Column(db.Text, default='[]')
 
+    # Денормализованные счётчики (см. counters.py)
+    subscribers_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    events_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
 
 # Модель пользователя
 class User(db.Model):
@@ -36,6 +91,8 @@ class User(db.Model):
     first_name = db.Column(db.String(50), nullable=False)
     last_name = db.Column(db.String(50), nullable=False)
     created_at = db.Column(db.DateTime, server_default=db.func.now())
+    # Время последнего изменения строки - из него строится ETag (см. etags.py)
+    updated_at = db.Column(db.DateTime, nullable=True, default=datetime.now, onupdate=datetime.now)
 
     # Основная информация (Сценарий 2)
     phone = db.Column(db.String(20), nullable=True)
@@ -50,28 +107,20 @@ class User(db.Model):
     profile_completed = db.Column(db.Boolean, default=False)
     preferences_completed = db.Column(db.Boolean, default=False)
 
-    # Метрики для ленты рекомендаций
-    interests_metrics = db.Column(db.Text, default=json.dumps({
-        'IT': 0.1, 'искусства': 0.1, 'музыка': 0.1, 'языки': 0.1,
-        'экономика': 0.1, 'менеджмент': 0.1, 'творчество': 0.1,
-        'спорт': 0.1, 'инжинерия': 0.1, 'культура': 0.1
-    }))
-    format_metrics = db.Column(db.Text, default=json.dumps({
-        'онлайн': 0.33, 'офлайн': 0.33, 'гибрид': 0.34
-    }))
-    event_type_metrics = db.Column(db.Text, default=json.dumps({}))
-
-    # Метрики ленты рекомендаций
-    feed_metrics = db.Column(db.Text, default=json.dumps({
-        'click_rate': 0.0,
-        'like_rate': 0.0,
-        'time_spent': 0.0,
-        'completion_rate': 0.0,
-        'preferred_categories': {},
-        'preferred_formats': {},
-        'preferred_event_types': {}
-    }))
-
+    # Метрики для ленты рекомендаций хранятся построчно в user_tag_weight;
+    # версия растёт при каждой записи метрик (compare-and-swap в metrics_queue)
+    metrics_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # До какого момента затухание весов уже записано в user_tag_weight
+    last_decay_at = db.Column(db.DateTime, nullable=True)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        if self.last_decay_at is None:
+            self.last_decay_at = datetime.now()
+        # Начальные метрики нового пользователя (раньше - значения по умолчанию JSON-столбцов)
+        self.set_interests_metrics(DEFAULT_INTERESTS_METRICS)
+        self.set_format_metrics(DEFAULT_FORMAT_METRICS)
+        self.set_feed_metrics(DEFAULT_FEED_METRICS)
 
     def set_password(self, password):
         self.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
@@ -79,29 +128,102 @@ class User(db.Model):
     def check_password(self, password):
         return bcrypt.check_password_hash(self.password_hash, password)
 
+    def get_dimension_weights(self, dimension):
+        # Порядок тегов не зависит от того, добавлены ли строки в этой сессии:
+        # от него зависит порядок суммирования при нормализации
+        rows = sorted((row for row in self.tag_weights if row.dimension == dimension), key=lambda row: row.tag)
+        return {row.tag: row.weight for row in rows}
+
+    def set_dimension_weights(self, dimension, metrics_dict):
+        """Синхронизирует строки измерения со словарём, трогая только изменившиеся"""
+        current = {row.tag: row for row in self.tag_weights if row.dimension == dimension}
+        for tag, row in current.items():
+            if tag not in metrics_dict:
+                self.tag_weights.remove(row)
+        for tag, weight in metrics_dict.items():
+            row = current.get(tag)
+            if row is None:
+                self.tag_weights.append(UserTagWeight(dimension=dimension, tag=tag, weight=weight))
+            elif row.weight != weight:
+                row.weight = weight
+        self._preference_vector = None
+
     def get_interests_metrics(self):
-        return json.loads(self.interests_metrics)
+        return self.get_dimension_weights('interests')
 
     def set_interests_metrics(self, metrics_dict):
-        self.interests_metrics = json.dumps(metrics_dict)
+        self.set_dimension_weights('interests', metrics_dict)
 
     def get_format_metrics(self):
-        return json.loads(self.format_metrics)
+        return self.get_dimension_weights('formats')
 
     def set_format_metrics(self, metrics_dict):
-        self.format_metrics = json.dumps(metrics_dict)
+        self.set_dimension_weights('formats', metrics_dict)
 
     def get_event_type_metrics(self):
-        return json.loads(self.event_type_metrics)
+        return self.get_dimension_weights('event_types')
 
     def set_event_type_metrics(self, metrics_dict):
-        self.event_type_metrics = json.dumps(metrics_dict)
+        self.set_dimension_weights('event_types', metrics_dict)
+
+    def set_survey_metrics(self, interests, formats, event_types):
+        """Метрики из анкеты: становятся текущими и запоминаются как база для пересборки"""
+        for dimension, metrics in (('interests', interests), ('formats', formats), ('event_types', event_types)):
+            self.set_dimension_weights(dimension, metrics)
+            self.set_dimension_weights(SURVEY_DIMENSIONS[dimension], metrics)
+
+    def get_survey_metrics(self):
+        """{измерение: веса} из анкеты или None, если анкета не сохранялась"""
+        if not any(row.dimension in SURVEY_DIMENSIONS.values() for row in self.tag_weights):
+            return None
+        return {dimension: self.get_dimension_weights(survey) for dimension, survey in SURVEY_DIMENSIONS.items()}
 
     def get_feed_metrics(self):
-        return json.loads(self.feed_metrics)
+        metrics = {name: 0.0 for name in FEED_STATS}
+        metrics.update(self.get_dimension_weights(FEED_STATS_DIMENSION))
+        for dimension in FEED_PREFERENCE_DIMENSIONS:
+            metrics[dimension] = self.get_dimension_weights(dimension)
+        return metrics
 
     def set_feed_metrics(self, metrics_dict):
-        self.feed_metrics = json.dumps(metrics_dict)
+        for dimension, weights in split_feed_metrics(metrics_dict).items():
+            self.set_dimension_weights(dimension, weights)
+
+    def decay_priors(self):
+        """База затухания по измерениям: ответы анкеты, без анкеты - начальные метрики
+
+        Анкета хранится как есть (1.0 на тег), а обучаемые веса нормируются
+        после каждой записи, поэтому база нормируется тем же normalize_metrics.
+        У измерений ленты базы нет - их веса затухают к нулю.
+        """
+        survey = self.get_survey_metrics() or {'interests': DEFAULT_INTERESTS_METRICS,
+                                                 'formats': DEFAULT_FORMAT_METRICS}
+        return {dimension: utils.normalize_metrics(weights) for dimension, weights in survey.items()}
+
+    def apply_decay(self, now=None):
+        """Записывает накопленное затухание в веса; вызывается перед записью метрик"""
+        now = now or datetime.now()
+        if self.last_decay_at is None:
+            # Старые пользователи начинают затухать с первой записи
+            self.last_decay_at = now
+            return
+        steps = decay_steps(self.last_decay_at, now)
+        if not steps:
+            return
+        priors = self.decay_priors()
+        for dimension in DECAYED_DIMENSIONS:
+            weights = decay_weights(self.get_dimension_weights(dimension), steps, priors.get(dimension))
+            self.set_dimension_weights(dimension, weights)
+        # Остаток неполных суток сохраняется, чтобы затухание не отставало
+        self.last_decay_at += timedelta(days=steps)
+
+    def get_preference_vector(self):
+        """Разобранные метрики для расчёта релевантности, один раз на версию метрик"""
+        vector = getattr(self, '_preference_vector', None)
+        if vector is None or vector.stamp != UserPreferenceVector.user_stamp(self):
+            vector = UserPreferenceVector.from_user(self)
+            self._preference_vector = vector
+        return vector
 
     def update_feed_metrics(self, post, action_type, value=1.0):
         metrics = self.get_feed_metrics()
@@ -129,6 +251,19 @@ class User(db.Model):
 
         self.set_feed_metrics(metrics)
 
+    def update_feed_stats(self, interactions):
+        """Сворачивает пачку взаимодействий [(тип, значение)] в счётчики ленты
+
+        Каждое событие сдвигает свой счётчик так же, как действие 'click'
+        в update_feed_metrics: (текущее + значение) / 2, по порядку событий.
+        """
+        metrics = self.get_feed_metrics()
+        for action, value in interactions:
+            stat = FEED_STAT_ACTIONS.get(action)
+            if stat is not None:
+                metrics[stat] = (metrics[stat] + value) / 2
+        self.set_dimension_weights(FEED_STATS_DIMENSION, {name: metrics[name] for name in FEED_STATS})
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -159,6 +294,8 @@ class PostEvent(db.Model):
     description = db.Column(db.String(1000), nullable=False)
     date_time = db.Column(db.DateTime, nullable=False)
     created_at = db.Column(db.DateTime, server_default=db.func.now())
+    # Время последнего изменения строки - из него строится ETag (см. etags.py)
+    updated_at = db.Column(db.DateTime, nullable=True, default=datetime.now, onupdate=datetime.now)
     pic = db.Column(db.String(500), nullable=True)
     location = db.Column(db.String(500), nullable=True)  # для офлайн мероприятий
     event_type = db.Column(db.String(100), nullable=True)  # тип события
@@ -170,6 +307,10 @@ class PostEvent(db.Model):
     # Внешние ключи
     organization_id = db.Column(db.Integer, db.ForeignKey('organisation.id'), nullable=False)
 
+    # Денормализованные счётчики (см. counters.py)
+    likes_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    registered_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
     def set_interest_tags(self, tags_list):
         self.interest_tags = json.dumps(tags_list)
 
@@ -191,22 +332,19 @@ class PostEvent(db.Model):
 
     def calculate_relevance_score(self, user):
         try:
-            user_interests = user.get_interests_metrics()
-            user_formats = user.get_format_metrics()
-            user_event_types = user.get_event_type_metrics()
-            user_feed_metrics = user.get_feed_metrics()
+            preferences = user.get_preference_vector()
 
             post_interests = self.get_interest_tags()
             post_formats = self.get_format_tags()
 
-            interest_score = sum(user_interests.get(tag, 0.0) for tag in post_interests)
-            format_score = sum(user_formats.get(tag, 0.0) for tag in post_formats)
-            event_type_score = user_event_types.get(self.event_type, 0.0) if self.event_type else 0.0
+            interest_score = sum(preferences.interests.get(tag, 0.0) for tag in post_interests)
+            format_score = sum(preferences.formats.get(tag, 0.0) for tag in post_formats)
+            event_type_score = preferences.event_types.get(self.event_type, 0.0) if self.event_type else 0.0
 
-            feed_interest_score = sum(user_feed_metrics['preferred_categories'].get(tag, 0) for tag in post_interests)
-            feed_format_score = sum(user_feed_metrics['preferred_formats'].get(tag, 0) for tag in post_formats)
-            feed_event_score = user_feed_metrics['preferred_event_types'].get(self.event_type,
-                                                                              0) if self.event_type else 0.0
+            feed_interest_score = sum(preferences.preferred_categories.get(tag, 0) for tag in post_interests)
+            feed_format_score = sum(preferences.preferred_formats.get(tag, 0) for tag in post_formats)
+            feed_event_score = preferences.preferred_event_types.get(self.event_type,
+                                                                     0) if self.event_type else 0.0
 
             total_score = (
                     interest_score * 0.3 +
@@ -223,26 +361,17 @@ class PostEvent(db.Model):
             print(f"ERROR: Ошибка в calculate_relevance_score: {e}")
             return 0.1
 
-    def to_dict(self):
+    def to_dict(self, related=None):
+        """related - данные пачки постов из serializers.PostRelations вместо запросов на каждый пост"""
         try:
-            org = Organisation.query.get(self.organization_id)
-            org_data = None
-            if org:
-                org_data = {
-                    'id': org.id,
-                    'title': org.title,
-                    'avatar': org.avatar
-                }
-
-            # Безопасно получаем количество лайков и регистраций
-            likes_count = 0
-            registered_count = 0
+            if related is not None:
+                org = related.organisations.get(self.organization_id)
+            else:
+                org = Organisation.query.get(self.organization_id)
 
-            if hasattr(self, 'liked_by'):
-                likes_count = len(self.liked_by)
-
-            if hasattr(self, 'registered_users'):
-                registered_count = len(self.registered_users)
+            # Счётчики хранятся в строке поста, коллекции не загружаются
+            likes_count = self.likes_count or 0
+            registered_count = self.registered_count or 0
 
             return {
                 'id': self.id,
@@ -308,10 +437,10 @@ class PostSimple(db.Model):
 
     def calculate_relevance_score(self, user):
         try:
-            # Получаем метрики пользователя
-            user_interests = user.get_interests_metrics() or {}
-            user_formats = user.get_format_metrics() or {}
-            user_feed_metrics = user.get_feed_metrics() or {}
+            # Получаем разобранные метрики пользователя (один раз на запрос)
+            preferences = user.get_preference_vector()
+            user_interests = preferences.interests
+            user_formats = preferences.formats
 
             # Теги поста
             post_interests = self.get_interest_tags() or []
@@ -335,8 +464,8 @@ class PostSimple(db.Model):
                 format_score = format_score / len(post_formats)
 
             # Учет метрик ленты
-            feed_preferred_categories = user_feed_metrics.get('preferred_categories', {})
-            feed_preferred_formats = user_feed_metrics.get('preferred_formats', {})
+            feed_preferred_categories = preferences.preferred_categories
+            feed_preferred_formats = preferences.preferred_formats
 
             feed_interest_score = sum(feed_preferred_categories.get(tag, 0) for tag in post_interests)
             feed_format_score = sum(feed_preferred_formats.get(tag, 0) for tag in post_formats)
@@ -361,14 +490,18 @@ class PostSimple(db.Model):
             return 0.1
 
 
-    def to_dict(self):
+    def to_dict(self, related=None):
+        """related - данные пачки постов из serializers.PostRelations вместо запросов на каждый пост"""
         try:
             org_data = None
             author_data = None
 
             # Получаем организацию если есть
             if self.organization_id:
-                org = db.session.get(Organisation, self.organization_id)
+                if related is not None:
+                    org = related.organisations.get(self.organization_id)
+                else:
+                    org = db.session.get(Organisation, self.organization_id)
                 if org:
                     org_data = {
                         'id': org.id,
@@ -378,7 +511,10 @@ class PostSimple(db.Model):
 
             # Получаем автора если есть
             if self.author_id:
-                author = db.session.get(User, self.author_id)
+                if related is not None:
+                    author = related.authors.get(self.author_id)
+                else:
+                    author = db.session.get(User, self.author_id)
                 if author:
                     author_data = {
                         'id': author.id,
@@ -411,6 +547,90 @@ class PostSimple(db.Model):
             }
 
 
+class Tag(db.Model):
+    """Словарь тегов: целочисленный id вместо повторяющейся строки (см. tags.py)"""
+    __tablename__ = 'tag'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), unique=True, nullable=False)
+
+
+class UserTagWeight(db.Model):
+    """Вес тега в метриках пользователя: одна строка на (пользователь, измерение, тег)"""
+    __tablename__ = 'user_tag_weight'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    # interests, formats, event_types, feed и preferred_* из метрик ленты
+    dimension = db.Column(db.String(30), primary_key=True)
+    tag = db.Column(db.String(100), primary_key=True)
+    weight = db.Column(db.Float, nullable=False, default=0.0)
+
+    __table_args__ = (
+        # Поиск пользователей, которым интересен тег, без обхода всей таблицы
+        db.Index('ix_user_tag_weight_tag', 'dimension', 'tag', 'weight'),
+    )
+
+    @classmethod
+    def users_with_tag(cls, dimension, tag, min_weight=0.0):
+        """id пользователей с весом тега больше min_weight, по убыванию веса"""
+        rows = db.session.query(cls.user_id).filter(
+            cls.dimension == dimension, cls.tag == tag, cls.weight > min_weight
+        ).order_by(cls.weight.desc())
+        return [user_id for user_id, in rows]
+
+
+class InteractionLog(db.Model):
+    """Журнал взаимодействий с постами (POST /api/interactions/batch), только дозапись"""
+    __tablename__ = 'interaction_log'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    post_type = db.Column(db.String(10), nullable=False)  # event / post
+    post_id = db.Column(db.Integer, nullable=False)
+    type = db.Column(db.String(20), nullable=False)  # impression / click / dwell / completion
+    value = db.Column(db.Float, nullable=False, default=1.0)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    __table_args__ = (
+        db.Index('ix_interaction_log_user_created', 'user_id', 'created_at'),
+    )
+
+
+class UserSeenFilter(db.Model):
+    """Фильтр Блума просмотренных постов пользователя (см. seen.py)"""
+    __tablename__ = 'user_seen_filter'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    # Текущее поколение пополняется, предыдущее только проверяется до следующей ротации
+    current = db.Column(db.LargeBinary, nullable=False)
+    previous = db.Column(db.LargeBinary, nullable=True)
+    current_count = db.Column(db.Integer, nullable=False, default=0)
+    previous_count = db.Column(db.Integer, nullable=False, default=0)
+    rotated_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+
+class CatalogChange(db.Model):
+    """Журнал изменений каталога постов: version - сквозной счётчик catalog_version"""
+    __tablename__ = 'catalog_change'
+    version = db.Column(db.Integer, primary_key=True)
+    post_type = db.Column(db.String(10), nullable=False)  # event / post
+    post_id = db.Column(db.Integer, nullable=False)
+
+
+class UserFeedSnapshot(db.Model):
+    """Предрасчитанный топ ленты пользователя (manage.py --precompute-feeds)"""
+    __tablename__ = 'user_feed_snapshot'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    # Отпечаток вектора предпочтений и каталога на момент расчёта
+    fingerprint = db.Column(db.String(40), nullable=False)
+    catalog_signature = db.Column(db.String(100), nullable=False)
+    total = db.Column(db.Integer, default=0)
+    # JSON-список [тип, id, оценка] в порядке выдачи
+    posts = db.Column(db.Text, default='[]')
+    computed_at = db.Column(db.DateTime, server_default=db.func.now())
+
+    def get_posts(self):
+        return json.loads(self.posts)
+
+    def set_posts(self, posts_list):
+        self.posts = json.dumps(posts_list)
+
 
 user_achievements = db.Table(
     'user_achievements',
@@ -437,6 +657,8 @@ user_registered_events = db.Table(
 )
 
 # --- Определяем связи ---
+User.tag_weights = db.relationship('UserTagWeight', lazy='selectin', cascade='all, delete-orphan',
+                                   order_by=(UserTagWeight.dimension, UserTagWeight.tag))
 User.achievements = db.relationship('Achievement', secondary=user_achievements, backref='users')
 User.subscriptions = db.relationship('Organisation', secondary=user_subscriptions, backref='subscribers')
 User.liked_event_posts = db.relationship('PostEvent', secondary=user_liked_posts, backref='liked_by')
@@ -445,3 +667,13 @@ User.user_posts = db.relationship('PostSimple', backref='author', lazy=True)
 User.user_organisations = db.relationship('Organisation', backref='owner', lazy=True, foreign_keys='Organisation.owner_id')
 Organisation.event_posts = db.relationship('PostEvent', backref='organization', lazy=True)
 Organisation.simple_posts = db.relationship('PostSimple', backref='organization', lazy=True)
+
+
+@event.listens_for(Session, 'before_flush')
+def _touch_updated_at(session, flush_context, instances):
+    """Лайк, регистрация или подписка меняют только таблицу связи, а не строку
+    пользователя - отмечаем изменение сами, чтобы ETag профиля сменился"""
+    now = datetime.now()
+    for instance in session.dirty:
+        if isinstance(instance, (User, Organisation)) and session.is_modified(instance):
+            instance.updated_at = now
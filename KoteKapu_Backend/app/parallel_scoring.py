@@ -0,0 +1,162 @@
+"""Шардированный расчёт релевантности для очень больших каталогов
+
+Буферы разреженной матрицы признаков (indptr, indices и веса в формате CSR)
+кладутся в multiprocessing.shared_memory, постоянный пул процессов считает
+top-k по своему диапазону строк, а запрос сливает частичные топы k-путевым
+слиянием на куче.
+"""
+
+import heapq
+import itertools
+import multiprocessing
+import os
+import threading
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .scoring import ScoringEngine, SCORE_DECIMALS, top_k
+
+# Ниже этого размера каталога пересылка задач дороже самого расчёта
+PARALLEL_MIN_POSTS = 100_000
+PARALLEL_WORKERS = max(2, (os.cpu_count() or 2) - 1)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Подключенные сегменты разделяемой памяти внутри процесса пула
+_attached = {}
+
+
+def get_pool():
+    """Постоянный пул процессов, общий для всех движков воркера"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: дочерние процессы не наследуют соединения и потоки сервера
+            _pool = multiprocessing.get_context('spawn').Pool(PARALLEL_WORKERS)
+        return _pool
+
+
+def _csr_buffers(buffer, rows, entries):
+    """indptr, indices, веса анкеты и ленты подряд в одном буфере"""
+    indptr = np.ndarray(rows + 1, dtype=np.int64, buffer=buffer)
+    offset = indptr.nbytes
+    indices = np.ndarray(entries, dtype=np.int64, buffer=buffer, offset=offset)
+    offset += indices.nbytes
+    survey = np.ndarray(entries, dtype=np.float64, buffer=buffer, offset=offset)
+    offset += survey.nbytes
+    feed = np.ndarray(entries, dtype=np.float64, buffer=buffer, offset=offset)
+    return indptr, indices, survey, feed
+
+
+def _shard_top_k(args):
+    """Top-k по диапазону строк CSR-матрицы из разделяемой памяти"""
+    name, rows, entries, start, end, vector, k = args
+    segment = _attached.get(name)
+    if segment is None:
+        # Старые сегменты после пересборки движка больше не нужны
+        for stale in _attached.values():
+            stale.close()
+        _attached.clear()
+        segment = _attached[name] = shared_memory.SharedMemory(name=name)
+
+    indptr, indices, survey, feed = _csr_buffers(segment.buf, rows, entries)
+    # Элементы шарда - непрерывный отрезок [indptr[start], indptr[end])
+    first, last = indptr[start], indptr[end]
+    columns = indices[first:last]
+    width = len(vector) // 2
+    contributions = (survey[first:last] * vector[columns]
+                     + feed[first:last] * vector[width + columns])
+    local = np.repeat(np.arange(end - start), np.diff(indptr[start:end + 1]))
+    scores = np.bincount(local, contributions, minlength=end - start)
+    scores = np.round(scores, SCORE_DECIMALS)
+    selected = top_k(scores, k)
+    return (selected + start).tolist(), scores[selected].tolist()
+
+
+class ParallelScoringEngine(ScoringEngine):
+    """Движок с тем же интерфейсом, считающий каталог шардами в пуле процессов"""
+
+    def __init__(self, rows, interned=False):
+        super().__init__(rows, interned)
+        self.segment = None
+        # Число вызовов, читающих буферы сегмента, и запрошенное закрытие
+        self._active = 0
+        self._closing = False
+        self._lock = threading.Lock()
+        self.top_only = len(self.keys) >= PARALLEL_MIN_POSTS
+        if self.top_only:
+            size = 8 * (len(self.indptr) + 3 * len(self.indices))
+            self.segment = shared_memory.SharedMemory(create=True, size=size)
+            shared = _csr_buffers(self.segment.buf, len(self.keys), len(self.indices))
+            for target, source in zip(shared, self._buffers()):
+                target[:] = source
+            # Буферы теперь живут в разделяемой памяти, копии процесса освобождаем
+            self.indptr, self.indices, self.survey, self.feed = shared
+
+    def _buffers(self):
+        return self.indptr, self.indices, self.survey, self.feed
+
+    @contextmanager
+    def _using(self):
+        """Держит сегмент (или None, если он уже освобождён) на время расчёта"""
+        with self._lock:
+            self._active += 1
+            segment = self.segment
+        try:
+            yield segment
+        finally:
+            with self._lock:
+                self._active -= 1
+                if self._closing and not self._active:
+                    self._release()
+
+    def _release(self):
+        if self.segment is not None:
+            self.indptr, self.indices, self.survey, self.feed = (
+                np.array(buffer) for buffer in self._buffers())
+            self.segment.close()
+            self.segment.unlink()
+            self.segment = None
+            self.top_only = False
+
+    def close(self):
+        """Освобождает сегмент сразу или после последнего идущего расчёта"""
+        with self._lock:
+            self._closing = True
+            if not self._active:
+                self._release()
+
+    def score(self, user):
+        with self._using():
+            return super().score(user)
+
+    def score_candidates(self, user):
+        with self._using():
+            return super().score_candidates(user)
+
+    def top(self, user, k):
+        with self._using() as segment:
+            if segment is None:
+                return super().top(user, k)
+            return self._top(segment, user, k)
+
+    def _top(self, segment, user, k):
+        vector = self.user_vector(user)
+        bounds = np.linspace(0, len(self.keys), PARALLEL_WORKERS + 1, dtype=int)
+        tasks = [
+            (segment.name, len(self.keys), len(self.indices), int(start), int(end),
+             vector, k)
+            for start, end in zip(bounds[:-1], bounds[1:]) if end > start
+        ]
+        shards = get_pool().map(_shard_top_k, tasks)
+
+        # Каждый шард уже упорядочен по (-оценка, строка) - сливаем их кучей
+        streams = [
+            [(-score, row) for row, score in zip(rows, scores)]
+            for rows, scores in shards
+        ]
+        merged = itertools.islice(heapq.merge(*streams), k)
+        return [(self.keys[row], -negative) for negative, row in merged]
@@ -0,0 +1,156 @@
+"""Офлайн-предрасчёт лент пользователей в таблицу user_feed_snapshot"""
+
+import json
+import multiprocessing
+import time
+from datetime import datetime
+
+from .extensions import db
+from .models import User, UserFeedSnapshot
+from . import feed
+from . import scoring
+from .catalog import catalog
+
+# Сколько позиций ленты сохраняем на пользователя
+DEFAULT_DEPTH = 200
+# Сколько пользователей отдаём воркеру за одну задачу
+CHUNK_SIZE = 100
+
+_worker_app = None
+_worker_engine = None
+
+
+def _init_worker():
+    """Каждый процесс пула работает со своим приложением и соединением с БД"""
+    global _worker_app
+    from . import create_app
+    _worker_app = create_app()
+    _worker_app.app_context().push()
+
+
+def _engine():
+    """numpy-движок процесса пула независимо от FEED_SCORING_BACKEND
+
+    Снимку нужны оценки всех кандидатов (score_candidates), которых нет у
+    top-only движков sql и parallel, а свой пул процессов внутри пула
+    предрасчёта только мешал бы.
+    """
+    global _worker_engine
+    signature = scoring.catalog_signature()
+    if _worker_engine is None or _worker_engine[0] != signature:
+        _worker_engine = (signature, scoring.ScoringEngine.from_catalog(signature))
+    return _worker_engine[1]
+
+
+def _compute_chunk(args):
+    """Считает топ ленты для пачки пользователей-представителей"""
+    user_ids, depth = args
+    results = []
+    engine = _engine()
+    for user in User.query.filter(User.id.in_(user_ids)).all():
+        rows, scores = engine.score_candidates(user)
+        snapshot = feed.FeedSnapshot(engine.keys, rows, scores)
+        ranking = [[kind, post_id, score]
+                   for (kind, post_id), score in snapshot.page(0, depth)]
+        results.append((user.id, ranking))
+    db.session.remove()
+    return results
+
+
+def _stale_groups(signature_key, active_only):
+    """Группы пользователей с одинаковым отпечатком, чей снимок устарел
+
+    Пересчитываются только пользователи, у которых изменились метрики
+    или каталог с прошлого запуска. Ранжирование зависит только от
+    отпечатка, поэтому на группу считается один представитель.
+    """
+    existing = {
+        user_id: (fingerprint, catalog_signature)
+        for user_id, fingerprint, catalog_signature in db.session.query(
+            UserFeedSnapshot.user_id, UserFeedSnapshot.fingerprint,
+            UserFeedSnapshot.catalog_signature)
+    }
+
+    query = User.query.order_by(User.id)
+    if active_only:
+        query = query.filter(User.preferences_completed.is_(True))
+
+    groups = {}
+    skipped = 0
+    for user in query.yield_per(1000):
+        fingerprint = user.get_preference_vector().fingerprint
+        if existing.get(user.id) == (fingerprint, signature_key):
+            skipped += 1
+            continue
+        groups.setdefault(fingerprint, []).append(user.id)
+    return groups, skipped
+
+
+def _write_snapshots(groups, rankings, signature_key, total):
+    now = datetime.now()
+    assignments = {}
+    for fingerprint, user_ids in groups.items():
+        ranking = rankings.get(user_ids[0])
+        if ranking is None:
+            continue
+        posts = json.dumps(ranking)
+        for user_id in user_ids:
+            assignments[user_id] = (fingerprint, posts)
+
+    user_ids = list(assignments)
+    for i in range(0, len(user_ids), CHUNK_SIZE):
+        chunk = user_ids[i:i + CHUNK_SIZE]
+        existing = {
+            snapshot.user_id: snapshot
+            for snapshot in UserFeedSnapshot.query.filter(
+                UserFeedSnapshot.user_id.in_(chunk))
+        }
+        for user_id in chunk:
+            snapshot = existing.get(user_id)
+            if snapshot is None:
+                snapshot = UserFeedSnapshot(user_id=user_id)
+                db.session.add(snapshot)
+            snapshot.fingerprint, snapshot.posts = assignments[user_id]
+            snapshot.catalog_signature = signature_key
+            snapshot.total = total
+            snapshot.computed_at = now
+    db.session.commit()
+
+
+def precompute_feeds(app, processes=None, depth=DEFAULT_DEPTH, active_only=False):
+    """Пересчитывает устаревшие снимки лент на пуле процессов"""
+    with app.app_context():
+        db.create_all()
+        started = time.monotonic()
+
+        signature = scoring.catalog_signature()
+        signature_key = scoring.signature_key(signature)
+        total = len(catalog)
+
+        groups, skipped = _stale_groups(signature_key, active_only)
+        representatives = [user_ids[0] for user_ids in groups.values()]
+        stale_users = sum(len(user_ids) for user_ids in groups.values())
+        print(f"🔄 Пользователей к пересчёту: {stale_users} "
+              f"(уникальных лент: {len(representatives)}), актуальных: {skipped}")
+
+        if not representatives:
+            print("✅ ВСЕ СНИМКИ ЛЕНТ АКТУАЛЬНЫ")
+            return
+
+        chunks = [(representatives[i:i + CHUNK_SIZE], depth)
+                  for i in range(0, len(representatives), CHUNK_SIZE)]
+
+        # Соединения родителя не должны попасть в дочерние процессы
+        db.session.remove()
+        db.engine.dispose()
+
+        rankings = {}
+        with multiprocessing.Pool(processes=processes,
+                                  initializer=_init_worker) as pool:
+            for results in pool.imap_unordered(_compute_chunk, chunks):
+                rankings.update(results)
+
+        _write_snapshots(groups, rankings, signature_key, total)
+        elapsed = time.monotonic() - started
+        print(f"✅ СНИМКИ ЛЕНТ ОБНОВЛЕНЫ: {stale_users} пользователей "
+              f"за {elapsed:.1f} с")
@@ -0,0 +1,140 @@
+"""Разобранный вектор предпочтений пользователя для расчёта релевантности"""
+
+import hashlib
+import json
+from datetime import datetime
+
+# Словари предпочтений внутри feed_metrics
+FEED_PREFERENCE_DIMENSIONS = ('preferred_categories', 'preferred_formats',
+                              'preferred_event_types')
+
+# Затухание: отклонение весов от базы (User.decay_priors) уменьшается вдвое
+# за период полураспада. Шаг - сутки, чтобы вектор (и его отпечаток в кэше
+# лент) менялся не чаще раза в день.
+DECAY_HALF_LIFE_DAYS = 30
+
+
+def decay_steps(last_decay_at, now=None):
+    """Сколько полных суток затухания накопилось с last_decay_at"""
+    if last_decay_at is None:
+        return 0
+    return max(0, ((now or datetime.now()) - last_decay_at).days)
+
+
+def decay_weights(metrics, steps, prior=None):
+    """Веса после steps суток затухания к базе prior (теги без базы - к нулю)
+
+    База нормирована так же, как веса после каждой записи, поэтому давние
+    интересы со временем уступают её распределению, а свежие лайки, которых
+    в базе нет, теряют вес быстрее всего.
+    """
+    prior = prior or {}
+    if not steps or not (metrics or prior):
+        return metrics
+    factor = 0.5 ** (steps / DECAY_HALF_LIFE_DAYS)
+    decayed = {}
+    for tag in {**metrics, **prior}:
+        base = prior.get(tag, 0.0)
+        decayed[tag] = base + (metrics.get(tag, 0.0) - base) * factor
+    return decayed
+
+
+class UserPreferenceVector:
+    """Метрики пользователя, собранные из строк user_tag_weight один раз
+
+    Строится через User.get_preference_vector() и живёт, пока не изменятся
+    веса тегов или не наступят новые сутки затухания. Затухание применяется
+    здесь, при чтении, а в базу попадает только при следующей записи метрик
+    (User.apply_decay), поэтому неактивные пользователи ничего не стоят.
+    Словари считаются неизменяемыми - для правок есть get_*_metrics(),
+    которые возвращают свежие копии.
+    """
+
+    __slots__ = ('stamp', 'interests', 'formats', 'event_types', 'feed',
+                 '_fingerprint', '_packed')
+
+    def __init__(self, stamp, interests, formats, event_types, feed):
+        self.stamp = stamp
+        self.interests = interests
+        self.formats = formats
+        self.event_types = event_types
+        self.feed = feed
+        self._fingerprint = None
+        self._packed = None
+
+    @staticmethod
+    def user_stamp(user):
+        """Веса тегов и сутки затухания - по ним определяется актуальность вектора"""
+        rows = tuple((row.dimension, row.tag, row.weight) for row in user.tag_weights)
+        return rows, decay_steps(user.last_decay_at)
+
+    @classmethod
+    def from_user(cls, user):
+        stamp = cls.user_stamp(user)
+        steps = stamp[1]
+        feed = user.get_feed_metrics()
+        for dimension in FEED_PREFERENCE_DIMENSIONS:
+            feed[dimension] = decay_weights(feed[dimension], steps)
+        priors = user.decay_priors() if steps else {}
+        interests, formats, event_types = (
+            decay_weights(metrics, steps, priors.get(dimension))
+            for dimension, metrics in (('interests', user.get_interests_metrics()),
+                                       ('formats', user.get_format_metrics()),
+                                       ('event_types', user.get_event_type_metrics())))
+        return cls(stamp, interests, formats, event_types, feed)
+
+    @property
+    def preferred_categories(self):
+        return self.feed.get('preferred_categories') or {}
+
+    @property
+    def preferred_formats(self):
+        return self.feed.get('preferred_formats') or {}
+
+    @property
+    def preferred_event_types(self):
+        return self.feed.get('preferred_event_types') or {}
+
+    def dimensions(self):
+        """Метрики по измерениям: {измерение: (анкета, лента)}"""
+        return {
+            'interest': (self.interests, self.preferred_categories),
+            'format': (self.formats, self.preferred_formats),
+            'event_type': (self.event_types, self.preferred_event_types),
+        }
+
+    @property
+    def fingerprint(self):
+        """Отпечаток канонизированного вектора
+
+        Одинаков у всех, чьё ранжирование совпадает.
+
+        Учитываются только веса, влияющие на релевантность; нулевые веса и
+        счётчики вроде click_rate отбрасываются, ключи сортируются.
+        """
+        if self._fingerprint is None:
+            canonical = {
+                dimension: [
+                    sorted((tag, weight) for tag, weight in metrics.items() if weight)
+                    for metrics in pair
+                ]
+                for dimension, pair in self.dimensions().items()
+            }
+            raw = json.dumps(canonical, ensure_ascii=False, sort_keys=True)
+            self._fingerprint = hashlib.sha1(raw.encode('utf-8')).hexdigest()
+        return self._fingerprint
+
+    def packed(self, vocabulary):
+        """Измерения в виде {измерение: (анкета, лента)}
+
+        Каждая часть - пара array('I') id тегов и array('d') весов.
+
+        Упаковка пересобирается, только если словарь тегов пополнился.
+        """
+        if self._packed is None or self._packed[0] != len(vocabulary):
+            packed = {
+                dimension: tuple(vocabulary.pack(metrics) for metrics in pair)
+                for dimension, pair in self.dimensions().items()
+            }
+            self._packed = (len(vocabulary), packed)
+        return self._packed[1]
@@ -0,0 +1,262 @@
+"""Пересборка метрик пользователей из истории взаимодействий
+
+Запускается через manage.py --rebuild-metrics.
+
+Нужна после изменения правил обновления (шаг обучения в
+utils.update_user_interests, веса в update_feed_metrics): метрики каждого
+пользователя заново проигрываются от анкеты через те же функции.
+"""
+
+import json
+import multiprocessing
+import os
+import time
+from datetime import datetime
+
+from . import utils
+from .extensions import db
+from .models import (User, PostEvent, UserTagWeight, InteractionLog,
+                     user_liked_posts, user_registered_events, DECAYED_DIMENSIONS,
+                     FEED_STATS_DIMENSION, FEED_STAT_ACTIONS)
+from .precompute import _init_worker
+
+# Сколько пользователей обрабатывает воркер за одну задачу
+CHUNK_SIZE = 200
+DEFAULT_CHECKPOINT = 'rebuild_metrics.checkpoint.json'
+# Сколько раз пересчитывать пользователей, чьи метрики изменились,
+# пока их пачка пересобиралась
+CONFLICT_RETRIES = 5
+
+# Измерения, которые пересобираются целиком; анкета survey_* остаётся как есть
+REBUILT_DIMENSIONS = DECAYED_DIMENSIONS + (FEED_STATS_DIMENSION,)
+
+
+def _history(user_ids):
+    """История пачки пользователей
+
+    Возвращает {user_id: [(действие, id поста)]}, {id поста: пост}
+    и {user_id: [(тип, значение)]} из журнала взаимодействий.
+
+    В таблицах лайков и регистраций нет времени, поэтому сначала
+    проигрываются лайки, затем регистрации, каждые по возрастанию id поста.
+    """
+    likes = db.session.query(
+        user_liked_posts.c.user_id, user_liked_posts.c.post_event_id
+    ).filter(
+        user_liked_posts.c.user_id.in_(user_ids)
+    ).order_by(user_liked_posts.c.post_event_id)
+    registrations = db.session.query(
+        user_registered_events.c.user_id, user_registered_events.c.post_event_id
+    ).filter(
+        user_registered_events.c.user_id.in_(user_ids)
+    ).order_by(user_registered_events.c.post_event_id)
+
+    actions = {}
+    for action, rows in (('like', likes), ('register', registrations)):
+        for user_id, post_id in rows:
+            actions.setdefault(user_id, []).append((action, post_id))
+
+    post_ids = {post_id for user_actions in actions.values()
+                for _, post_id in user_actions}
+    posts = {}
+    if post_ids:
+        posts = {post.id: post
+                 for post in PostEvent.query.filter(PostEvent.id.in_(post_ids))}
+
+    interactions = {}
+    logged = db.session.query(
+        InteractionLog.user_id, InteractionLog.type, InteractionLog.value
+    ).filter(
+        InteractionLog.user_id.in_(user_ids),
+        InteractionLog.type.in_(list(FEED_STAT_ACTIONS))
+    ).order_by(InteractionLog.created_at, InteractionLog.id)
+    for user_id, action, value in logged:
+        interactions.setdefault(user_id, []).append((action, value))
+
+    return actions, posts, interactions
+
+
+def _replay(user, actions, posts, interactions):
+    """Метрики пользователя, проигранные от анкеты: {измерение: {тег: вес}}"""
+    replica = User()
+    survey = user.get_survey_metrics()
+    if survey is not None:
+        replica.set_interests_metrics(survey['interests'])
+        replica.set_format_metrics(survey['formats'])
+        replica.set_event_type_metrics(survey['event_types'])
+
+    for action, post_id in actions:
+        post = posts.get(post_id)
+        if post is None:
+            continue
+        # Те же обновления, что в like_post_with_interests и register_for_event
+        utils.update_user_interests(replica, post)
+        if action == 'like':
+            replica.update_feed_metrics(post, 'like')
+    replica.update_feed_stats(interactions)
+
+    return {dimension: replica.get_dimension_weights(dimension)
+            for dimension in REBUILT_DIMENSIONS}
+
+
+def _rebuild_chunk(user_ids):
+    """Пересчитывает пачку пользователей
+
+    Возвращает последний id пачки, [(user_id, версия, метрики)]
+    и число пропущенных пользователей.
+    """
+    actions, posts, interactions = _history(user_ids)
+    results = []
+    skipped = 0
+    for user in User.query.filter(User.id.in_(user_ids)).order_by(User.id):
+        # Без сохранённой анкеты база неизвестна: пересборка стёрла бы
+        # ответы пользователя
+        if user.preferences_completed and user.get_survey_metrics() is None:
+            skipped += 1
+            continue
+        metrics = _replay(user, actions.get(user.id, []), posts,
+                          interactions.get(user.id, []))
+        results.append((user.id, user.metrics_version, metrics))
+    db.session.remove()
+    return user_ids[-1], results, skipped
+
+
+def _write_chunk(results, now):
+    """Записывает пачку: compare-and-swap версии, затем замена строк весов
+
+    Строки весов вставляются одним executemany. Возвращает число записанных
+    пользователей и id тех, у кого версия метрик успела измениться.
+    """
+    connection = db.session.connection()
+    written = []
+    conflicted = []
+    for user_id, version, _ in results:
+        swapped = connection.execute(
+            db.update(User)
+            .where(User.id == user_id, User.metrics_version == version)
+            .values(metrics_version=version + 1, last_decay_at=now)
+        ).rowcount == 1
+        if swapped:
+            written.append(user_id)
+        else:
+            # Метрики изменились, пока пачка считалась: живые обновления важнее,
+            # пользователь будет пересчитан заново от свежей версии
+            conflicted.append(user_id)
+
+    if written:
+        connection.execute(db.delete(UserTagWeight).where(
+            UserTagWeight.user_id.in_(written),
+            UserTagWeight.dimension.in_(REBUILT_DIMENSIONS)))
+        written_ids = set(written)
+        rows = [
+            {'user_id': user_id, 'dimension': dimension, 'tag': tag,
+             'weight': weight}
+            for user_id, _, metrics in results if user_id in written_ids
+            for dimension, weights in metrics.items()
+            for tag, weight in weights.items()
+        ]
+        if rows:
+            connection.execute(db.insert(UserTagWeight), rows)
+    db.session.commit()
+    return len(written), conflicted
+
+
+def _write_with_retries(results):
+    """Записывает пачку, пересчитывая конфликтных пользователей заново
+
+    Возвращает число записанных, число повторов и id пользователей, которые
+    так и не удалось записать за CONFLICT_RETRIES повторов.
+    """
+    written, conflicted = _write_chunk(results, datetime.now())
+    retried = 0
+    for _ in range(CONFLICT_RETRIES):
+        if not conflicted:
+            break
+        retried += len(conflicted)
+        _, results, _ = _rebuild_chunk(conflicted)
+        retry_written, conflicted = _write_chunk(results, datetime.now())
+        written += retry_written
+    return written, retried, conflicted
+
+
+def _load_checkpoint(path):
+    if not os.path.exists(path):
+        return 0
+    with open(path) as checkpoint:
+        return json.load(checkpoint)['last_user_id']
+
+
+def _save_checkpoint(path, last_user_id):
+    # Через временный файл, чтобы прерывание не оставило обрезанный JSON
+    with open(path + '.tmp', 'w') as checkpoint:
+        json.dump({'last_user_id': last_user_id,
+                   'updated_at': datetime.now().isoformat()}, checkpoint)
+    os.replace(path + '.tmp', path)
+
+
+def rebuild_metrics(app, processes=None, chunk_size=CHUNK_SIZE,
+                    checkpoint=DEFAULT_CHECKPOINT, restart=False):
+    """Пересобирает метрики всех пользователей на пуле процессов
+
+    Прерванный запуск продолжается с контрольной точки.
+    """
+    with app.app_context():
+        if restart and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        last_user_id = _load_checkpoint(checkpoint)
+        if last_user_id:
+            print(f"↩️  Продолжаем после пользователя {last_user_id} ({checkpoint})")
+
+        user_ids = [user_id for user_id, in db.session.query(User.id).filter(
+            User.id > last_user_id).order_by(User.id)]
+        chunks = [user_ids[i:i + chunk_size]
+                  for i in range(0, len(user_ids), chunk_size)]
+        print(f"🔄 Пользователей к пересборке: {len(user_ids)}, "
+              f"пачек: {len(chunks)}")
+        if not chunks:
+            print("✅ ПЕРЕСОБИРАТЬ НЕЧЕГО")
+            return
+
+        # Соединения родителя не должны попасть в дочерние процессы
+        db.session.remove()
+        db.engine.dispose()
+
+        started = time.monotonic()
+        processed = written = skipped = retried = 0
+        unresolved = []
+        with multiprocessing.Pool(processes=processes,
+                                  initializer=_init_worker) as pool:
+            # imap сохраняет порядок пачек: контрольная точка всегда закрывает
+            # непрерывный префикс id
+            for chunk_last_id, results, chunk_skipped in pool.imap(
+                    _rebuild_chunk, chunks):
+                chunk_written, chunk_retried, chunk_unresolved = (
+                    _write_with_retries(results))
+                unresolved.extend(chunk_unresolved)
+                # Контрольная точка не уходит дальше первого незаписанного
+                # пользователя, чтобы продолжение его не пропустило
+                if unresolved:
+                    _save_checkpoint(checkpoint, min(unresolved) - 1)
+                else:
+                    _save_checkpoint(checkpoint, chunk_last_id)
+
+                processed += len(results) + chunk_skipped
+                written += chunk_written
+                skipped += chunk_skipped
+                retried += chunk_retried
+                elapsed = time.monotonic() - started
+                print(f"   до id {chunk_last_id}: "
+                      f"{processed}/{len(user_ids)} пользователей, "
+                      f"{processed / elapsed:.0f} польз./с")
+
+        elapsed = time.monotonic() - started
+        if unresolved:
+            print(f"⚠️  Не записаны из-за конфликтов версий: "
+                  f"{len(unresolved)} пользователей, запустите снова, "
+                  f"чтобы продолжить с id {min(unresolved)}")
+        else:
+            os.remove(checkpoint)
+        print(f"✅ МЕТРИКИ ПЕРЕСОБРАНЫ: {written} пользователей "
+              f"за {elapsed:.1f} с "
+              f"({processed / elapsed:.0f} польз./с), без анкеты: {skipped}, "
+              f"повторов из-за конфликтов версий: {retried}")
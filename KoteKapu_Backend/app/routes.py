@@ -2,10 +2,20 @@
 from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
 from .extensions import db, bcrypt
-from .models import Achievement, Organisation, User, PostEvent, PostSimple
+from .models import Achievement, Organisation, User, PostEvent, PostSimple, InteractionLog
 from . import utils
 from . import models
 from . import constants
+from . import scoring
+from . import feed
+from . import metrics_queue
+from . import taxonomy
+from . import seen
+from . import serializers
+from . import counters
+from . import etags
+from . import tags
+from .catalog import catalog
 from flask import Flask, request, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
@@ -176,17 +186,24 @@ def complete_preferences(user_id):
         if not data:
             return jsonify({"error": "Отсутствуют данные"}), 400
 
-        # ПРОСТО СОХРАНЯЕМ ДАННЫЕ
-        interests = data.get('interests', [])
-        formats = data.get('formats', [])
-        event_types = data.get('eventTypes', [])  # Обрати внимание на eventTypes vs event_types
-
-        user.set_interests_metrics({interest: 1.0 for interest in interests})
-        user.set_format_metrics({format_type: 1.0 for format_type in formats})
-        user.set_event_type_metrics({event_type: 1.0 for event_type in event_types})
+        # Приводим ответы к канонической таксономии: категории раскрываются в теги
+        interests = taxonomy.expand_interests(data.get('interests', []))
+        formats = taxonomy.canonical_formats(data.get('formats', []))
+        event_types = [taxonomy.canonical_event_type(event_type)
+                       for event_type in data.get('eventTypes', [])]  # Обрати внимание на eventTypes vs event_types
+
+        user.apply_decay()
+        user.set_survey_metrics(
+            {interest: 1.0 for interest in interests},
+            {format_type: 1.0 for format_type in formats},
+            {event_type: 1.0 for event_type in event_types}
+        )
+        # Отложенные обновления, прочитавшие старые метрики, применятся к новым
+        user.metrics_version = User.metrics_version + 1
         user.preferences_completed = True
 
         db.session.commit()
+        feed.cache.invalidate_user(user.id)
 
         return jsonify({
             "message": "✅ ПРЕДПОЧТЕНИЯ СОХРАНЕНЫ!",
@@ -212,6 +229,18 @@ def get_user_profile(user_id):
         if current_user_id != user_id:
             return jsonify({"error": "Доступ запрещен"}), 403
 
+        # ETag по версиям строк без загрузки пользователя и его связей: сам пользователь
+        # (лайки, регистрации, подписки, достижения отмечают его updated_at) и его организации
+        version = db.session.query(User.updated_at, User.metrics_version).filter(User.id == user_id).first()
+        if version is None:
+            return jsonify({"error": "Пользователь не найден"}), 404
+        organisations = db.session.query(db.func.count(Organisation.id), db.func.max(Organisation.updated_at)).filter(
+            Organisation.owner_id == user_id).one()
+        etag = etags.make('profile', user_id, *version, *organisations)
+        cached = etags.not_modified(etag, private=True)
+        if cached is not None:
+            return cached
+
         user = db.session.get(User, user_id)
         if not user:
             return jsonify({"error": "Пользователь не найден"}), 404
@@ -281,7 +310,7 @@ def get_user_profile(user_id):
         }
 
         print("🚨 DEBUG: Sending response")
-        return jsonify(response_data), 200
+        return etags.tagged(jsonify(response_data), etag, private=True), 200
 
     except Exception as e:
         print(f"💥 CRITICAL ERROR in get_user_profile: {e}")
@@ -384,9 +413,9 @@ def get_user_events(user_id):
         print(f"DEBUG: Events counts - upcoming: {len(upcoming_events)}, past: {len(past_events)}, created: {len(created_events)}")
 
         return jsonify({
-            "upcoming_events": [event.to_dict() for event in upcoming_events],
-            "past_events": [event.to_dict() for event in past_events],
-            "created_events": [event.to_dict() for event in created_events]
+            "upcoming_events": serializers.serialize_posts(upcoming_events),
+            "past_events": serializers.serialize_posts(past_events),
+            "created_events": serializers.serialize_posts(created_events)
         }), 200
 
     except Exception as e:
@@ -400,14 +429,24 @@ def get_user_events(user_id):
 @jwt_required()
 def get_event_details(event_id):
     try:
+        # В ответе есть название и аватар организации - ETag зависит от обеих строк
+        version = db.session.query(PostEvent.updated_at, Organisation.updated_at).outerjoin(
+            Organisation, Organisation.id == PostEvent.organization_id).filter(PostEvent.id == event_id).first()
+        if version is None:
+            return jsonify({"error": "Событие не найдено"}), 404
+        etag = etags.make('event', event_id, *version)
+        cached = etags.not_modified(etag, private=True)
+        if cached is not None:
+            return cached
+
         event = db.session.get(PostEvent, event_id)
         if not event:
             return jsonify({"error": "Событие не найдено"}), 404
 
-        return jsonify({
+        return etags.tagged(jsonify({
             "event": event.to_dict(),
             "success": True
-        }), 200
+        }), etag, private=True), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -427,6 +466,11 @@ def search():
         limit = data.get('limit', 20)
         offset = data.get('offset', 0)
 
+        try:
+            fields = serializers.parse_fields(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
         # Базовый запрос
         events_query = PostEvent.query
         orgs_query = Organisation.query.filter_by(status='approved')
@@ -491,11 +535,15 @@ def search():
             events_query = events_query.filter(PostEvent.organization_id == filters['organization_id'])
 
         # Применяем пагинацию
-        events = events_query.offset(offset).limit(limit).all()
+        page_query = events_query.offset(offset).limit(limit)
+        if fields is not None:
+            # Незапрошенные столбцы не читаем из базы
+            page_query = page_query.options(serializers.load_only(PostEvent, fields))
+        events = page_query.all()
         organizations = orgs_query.offset(offset).limit(limit).all()
 
         return jsonify({
-            "events": [event.to_dict() for event in events],
+            "events": serializers.serialize_posts(events, fields),
             "organizations": [{
                 'id': org.id,
                 'title': org.title,
@@ -503,8 +551,8 @@ def search():
                 'avatar': org.avatar,
                 'city': org.city,
                 'tags': json.loads(org.tags) if org.tags else [],
-                'events_count': len(org.event_posts),
-                'subscribers_count': len(org.subscribers)
+                'events_count': org.events_count,
+                'subscribers_count': org.subscribers_count
             } for org in organizations],
             "total_events": events_query.count(),
             "total_organizations": orgs_query.count()
@@ -523,11 +571,11 @@ def get_search_suggestions():
             "дизайн", "бизнес", "стартапы", "искусство", "наука"
         ]
 
-        # Популярные теги из мероприятий
+        # Популярные теги из мероприятий - из каталога в памяти, без запроса
         popular_tags = []
-        events = PostEvent.query.limit(50).all()
+        events = [record for record in catalog.records() if record.kind == 'event'][:50]
         for event in events:
-            popular_tags.extend(event.get_interest_tags())
+            popular_tags.extend(tags.vocabulary.names(event.interest_tags))
 
         popular_tags = list(set(popular_tags))[:10]
 
@@ -578,24 +626,32 @@ def create_event(org_id):
             description=data['description'],
             date_time=datetime.fromisoformat(data['date_time'].replace('Z', '+00:00')),
             location=data.get('location'),
-            event_type=data.get('event_type'),
+            event_type=taxonomy.canonical_event_type(data.get('event_type')),
             organization_id=org_id
         )
 
-        # Устанавливаем теги
+        # Устанавливаем теги в канонической форме, чтобы при ранжировании хватало точного сравнения
         if data.get('interest_tags'):
-            event.set_interest_tags(data['interest_tags'])
+            event.set_interest_tags(taxonomy.canonical_tags(data['interest_tags']))
 
         if data.get('format_tags'):
-            event.set_format_tags(data['format_tags'])
+            event.set_format_tags(taxonomy.canonical_formats(data['format_tags']))
 
         # Изображение мероприятия
         if data.get('pic'):
             event.pic = data['pic']
 
+        # Версию читаем из базы, а не из троттлинга каталога: иначе старая
+        # версия может отставать и патч лент пропустит чужие записи
+        catalog.mark_stale()
+        catalog_signature = scoring.catalog_signature()
         db.session.add(event)
+        counters.increment(Organisation, organisation, 'events_count')
         db.session.commit()
 
+        # Новый пост досчитываем в закэшированных лентах, а не сбрасываем их
+        feed.on_post_created(event, catalog_signature)
+
         return jsonify({
             "message": "Мероприятие успешно создано",
             "event": event.to_dict()
@@ -620,13 +676,32 @@ def get_organization_events(org_id):
         limit = request.args.get('limit', 20, type=int)
         offset = request.args.get('offset', 0, type=int)
 
+        try:
+            fields = serializers.parse_fields(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        # Число и последнее изменение мероприятий одним запросом; добавление
+        # или удаление меняет число, правка - максимум updated_at
+        total_events, events_updated_at = db.session.query(
+            db.func.count(PostEvent.id), db.func.max(PostEvent.updated_at)
+        ).filter(PostEvent.organization_id == org_id).one()
+        etag = etags.make('organisation-events', org_id, organisation.updated_at, total_events,
+                          events_updated_at, request.query_string)
+        cached = etags.not_modified(etag)
+        if cached is not None:
+            return cached
+
         # Получаем мероприятия организации
         events_query = PostEvent.query.filter_by(organization_id=org_id)
-        total_events = events_query.count()
-        events = events_query.offset(offset).limit(limit).all()
-
-        return jsonify({
-            "events": [event.to_dict() for event in events],
+        page_query = events_query.offset(offset).limit(limit)
+        if fields is not None:
+            # Незапрошенные столбцы не читаем из базы
+            page_query = page_query.options(serializers.load_only(PostEvent, fields))
+        events = page_query.all()
+
+        return etags.tagged(jsonify({
+            "events": serializers.serialize_posts(events, fields),
             "total": total_events,
             "organization": {
                 'id': organisation.id,
@@ -636,19 +711,28 @@ def get_organization_events(org_id):
                 'city': organisation.city,
                 'status': organisation.status
             }
-        }), 200
+        }), etag), 200
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+PREFERENCE_CATEGORIES_ETAG = etags.make('categories', constants.INTEREST_CATEGORIES, constants.FORMAT_TYPES,
+                                        constants.EVENT_TYPES, taxonomy.CATEGORY_CLOSURE)
+
+
 @bp.route('/api/preferences/categories', methods=['GET'])
 def get_preference_categories():
     """Получение категорий для опроса предпочтений"""
-    return jsonify({
+    # Справочники меняются только с релизом - ETag считается один раз
+    cached = etags.not_modified(PREFERENCE_CATEGORIES_ETAG)
+    if cached is not None:
+        return cached
+    return etags.tagged(jsonify({
         "interest_categories": constants.INTEREST_CATEGORIES,
         "format_types": constants.FORMAT_TYPES,
-        "event_types": constants.EVENT_TYPES
-    }), 200
+        "event_types": constants.EVENT_TYPES,
+        "category_tags": taxonomy.CATEGORY_CLOSURE
+    }), PREFERENCE_CATEGORIES_ETAG), 200
 
 
 @bp.route('/api/events/<int:event_id>/register', methods=['POST'])
@@ -662,15 +746,13 @@ def register_for_event(event_id):
         if not user or not event:
             return jsonify({"error": "Пользователь или событие не найдены"}), 404
 
-        # Проверяем, не зарегистрирован ли уже пользователь
-        if user in event.registered_users:
+        # Проверяем по коллекции пользователя: список всех зарегистрированных на событие не нужен
+        if event in user.registered_events:
             return jsonify({"error": "Вы уже зарегистрированы на это событие"}), 400
 
-        # Регистрируем пользователя
-        event.registered_users.append(user)
-
-        # Обновляем метрики пользователя
-        utils.update_user_interests(user, event)
+        # Регистрируем пользователя, счётчик - в той же транзакции
+        user.registered_events.append(event)
+        counters.increment(PostEvent, event, 'registered_count')
 
         # Начисляем достижение за первую регистрацию
         if len(user.registered_events) == 1:  # Первая регистрация
@@ -681,6 +763,9 @@ def register_for_event(event_id):
 
         db.session.commit()
 
+        # Метрики пользователя обновятся при ближайшем сбросе очереди
+        metrics_queue.queue.push(user.id, event, interests=True)
+
         return jsonify({
             "message": "Вы успешно зарегистрированы на событие",
             "event": event.to_dict()
@@ -742,6 +827,12 @@ def get_organisation(org_id):
     if not organisation:
         return jsonify({"error": "Организация не найдена"}), 404
 
+    # Счётчики хранятся в строке организации, так что её updated_at покрывает весь ответ
+    etag = etags.make('organisation', org_id, organisation.updated_at)
+    cached = etags.not_modified(etag)
+    if cached is not None:
+        return cached
+
     org_data = {
         'id': organisation.id,
         'title': organisation.title,
@@ -751,12 +842,12 @@ def get_organisation(org_id):
         'status': organisation.status,
         'tags': json.loads(organisation.tags) if organisation.tags else [],
         'social_links': json.loads(organisation.social_links) if organisation.social_links else [],
-        'events_count': len(organisation.event_posts),
-        'subscribers_count': len(organisation.subscribers),
+        'events_count': organisation.events_count,
+        'subscribers_count': organisation.subscribers_count,
         'owner_id': organisation.owner_id
     }
 
-    return jsonify({"organisation": org_data}), 200
+    return etags.tagged(jsonify({"organisation": org_data}), etag), 200
 
 
 @bp.route('/api/organisations/<int:org_id>/subscribe', methods=['POST'])
@@ -774,6 +865,7 @@ def subscribe_to_organisation(org_id):
             return jsonify({"error": "Вы уже подписаны на эту организацию"}), 400
 
         user.subscriptions.append(organisation)
+        counters.increment(Organisation, organisation, 'subscribers_count')
 
         # Начисляем достижение за первую подписку
         if len(user.subscriptions) == 1:
@@ -786,7 +878,7 @@ def subscribe_to_organisation(org_id):
 
         return jsonify({
             "message": "Вы успешно подписались на организацию",
-            "subscribers_count": len(organisation.subscribers)
+            "subscribers_count": organisation.subscribers_count
         }), 200
 
     except Exception as e:
@@ -868,14 +960,37 @@ def get_recommended_feed():
         print(f"DEBUG: Feed request for user {user.id}")
         print(f"DEBUG: Limit: {limit}, Offset: {offset}")
 
-        # Получаем все посты
-        event_posts = PostEvent.query.all()
-        simple_posts = PostSimple.query.all()
-        all_posts = list(event_posts) + list(simple_posts)
-
-        print(f"DEBUG: Found posts: {len(all_posts)}")
-
-        if not all_posts:
+        # ?fields=... или ?view=compact - только нужные поля карточки
+        try:
+            fields = serializers.parse_fields(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        # Курсор указывает на сохранённый снимок ранжирования
+        snapshot = None
+        cursor = data.get('cursor')
+        if cursor:
+            decoded = feed.decode_cursor(cursor)
+            if decoded is None:
+                return jsonify({"error": "Неверный курсор"}), 400
+            snapshot_id, offset = decoded
+            snapshot = feed.snapshots.get(snapshot_id)
+
+        # Просмотренные посты пропускаются; каждый может сдвинуть страницу глубже
+        seen_posts = seen.SeenFilter.for_user(user.id)
+        depth = offset + limit + seen_posts.count
+
+        # Снимок из предрасчёта хранит только топ - глубже считаем заново
+        if snapshot is not None and not snapshot.covers(depth):
+            snapshot = None
+
+        if snapshot is None:
+            # Лента из кэша процесса, предрасчёта или векторным движком ДЛЯ ТЕКУЩЕГО ПОЛЬЗОВАТЕЛЯ
+            snapshot = feed.user_snapshot(user, depth=depth)
+
+        print(f"DEBUG: Found posts: {len(snapshot)}")
+
+        if not len(snapshot):
             print("DEBUG: No posts found, returning empty list")
             return jsonify({
                 "posts": [],
@@ -886,49 +1001,37 @@ def get_recommended_feed():
                 "message": "Нет доступных постов"
             }), 200
 
-        # Сортируем по релевантности ДЛЯ ТЕКУЩЕГО ПОЛЬЗОВАТЕЛЯ
-        scored_posts = []
-        for post in all_posts:
-            try:
-                score = post.calculate_relevance_score(user)
-                print(f"DEBUG: Post '{post.title}' - relevance: {score}")
-                scored_posts.append((post, score))
-            except Exception as e:
-                print(f"WARNING: Relevance calculation error for post {post.id}: {e}")
-                scored_posts.append((post, 0.1))
-
-        # Сортируем по убыванию релевантности
-        scored_posts.sort(key=lambda x: x[1], reverse=True)
-
-        print(f"DEBUG: After sorting - top-3:")
-        for i, (post, score) in enumerate(scored_posts[:3]):
-            print(f"DEBUG:   {i + 1}. '{post.title}' - {score}")
-
         # Применяем пагинацию
-        total_posts = len(scored_posts)
+        total_posts = len(snapshot)
         start_idx = min(offset, total_posts)
-        end_idx = min(offset + limit, total_posts)
 
-        paginated_posts = scored_posts[start_idx:end_idx]
+        # Отбираем только первые offset + limit постов
+        if seen_posts:
+            page, end_idx = snapshot.page_unseen(offset, limit, seen_posts)
+            end_idx = min(end_idx, total_posts)
+        else:
+            page = snapshot.page(offset, limit)
+            end_idx = min(offset + limit, total_posts)
 
         print(f"DEBUG: Pagination: {start_idx}-{end_idx} of {total_posts}")
 
-        # Формируем ответ
-        feed_posts = []
-        for post, score in paginated_posts:
-            post_data = post.to_dict()
-            post_data['relevance_score'] = round(score, 3)
-            feed_posts.append(post_data)
+        # Формируем ответ - загружаем только посты текущей страницы
+        feed_posts = serializers.serialize_page(page, fields)
 
         print(f"DEBUG: Returning {len(feed_posts)} posts")
 
+        # Следующая страница будет читаться из этого же снимка
+        if end_idx < total_posts:
+            feed.snapshots.put(snapshot)
+
         response_data = {
             "posts": feed_posts,
             "count": len(feed_posts),
             "total": total_posts,
             "offset": offset,
             "limit": limit,
-            "has_more": end_idx < total_posts
+            "has_more": end_idx < total_posts,
+            "next_cursor": feed.encode_cursor(snapshot.id, end_idx) if end_idx < total_posts else None
         }
 
         print(f"DEBUG: Final response: {len(feed_posts)} posts, has_more: {end_idx < total_posts}")
@@ -982,22 +1085,21 @@ def like_post_with_interests():
         if not post:
             return jsonify({"error": "Пост не найден"}), 404
 
-        # Обновляем метрики интересов на основе тегов поста
-        utils.update_user_interests(user, post)
-
-        # Обновляем метрики ленты
-        user.update_feed_metrics(post, 'like')
-
-        # Добавляем лайк в базу (если это мероприятие)
-        if isinstance(post, PostEvent) and user not in post.liked_by:
-            post.liked_by.append(user)
+        # Добавляем лайк в базу (если это мероприятие), счётчик - в той же транзакции
+        if isinstance(post, PostEvent) and post not in user.liked_event_posts:
+            user.liked_event_posts.append(post)
+            counters.increment(PostEvent, post, 'likes_count')
 
         db.session.commit()
 
+        # Метрики интересов и ленты обновятся при ближайшем сбросе очереди
+        metrics_queue.queue.push(user.id, post, interests=True, feed_action='like')
+
+        # Интересы ещё не пересчитаны: актуальные отдаёт GET /api/users/<id>/interests
         return jsonify({
-            "message": "Пост лайкнут и интересы обновлены",
+            "message": "Пост лайкнут, интересы будут обновлены",
             "post_id": post_id,
-            "user_interests": user.get_interests_metrics()
+            "interests_update": "queued"
         }), 200
 
     except Exception as e:
@@ -1037,16 +1139,14 @@ def debug_feed():
     if not user:
         return jsonify({"error": "Пользователь не найден"}), 404
 
-    # Просто возвращаем все посты без сортировки
-    event_posts = PostEvent.query.all()
-    simple_posts = PostSimple.query.all()
-    all_posts = list(event_posts) + list(simple_posts)
+    # Просто возвращаем все посты без сортировки, в порядке каталога
+    keys = [record.key for record in catalog.records()]
+    posts = scoring.load_posts(keys)
+    all_posts = [posts[key] for key in keys if key in posts]
 
-    feed_posts = []
-    for post in all_posts:
-        post_data = post.to_dict()
+    feed_posts = serializers.serialize_posts(all_posts)
+    for post_data in feed_posts:
         post_data['relevance_score'] = 0.5  # Фиктивный score
-        feed_posts.append(post_data)
 
     return jsonify({
         "posts": feed_posts,
@@ -1056,6 +1156,24 @@ def debug_feed():
     }), 200
 
 
+@bp.route('/api/debug/feed-cache', methods=['GET'])
+def debug_feed_cache():
+    """Счетчики кэша лент текущего воркера"""
+    return jsonify(feed.cache.stats()), 200
+
+
+@bp.route('/api/debug/catalog', methods=['GET'])
+def debug_catalog():
+    """Версия и счетчики каталога постов текущего воркера"""
+    return jsonify(catalog.stats()), 200
+
+
+@bp.route('/api/debug/metrics-queue', methods=['GET'])
+def debug_metrics_queue():
+    """Счетчики очереди отложенного обновления метрик текущего воркера"""
+    return jsonify(metrics_queue.queue.stats()), 200
+
+
 @bp.route('/api/feed', methods=['GET'])
 @jwt_required()
 def get_feed():
@@ -1066,29 +1184,11 @@ def get_feed():
         if not user:
             return jsonify({"error": "Пользователь не найден"}), 404
 
-        # Получаем все посты
-        event_posts = PostEvent.query.all()
-        simple_posts = PostSimple.query.all()
-        all_posts = list(event_posts) + list(simple_posts)
-
-        # Сортируем по релевантности
-        scored_posts = []
-        for post in all_posts:
-            score = post.calculate_relevance_score(user)
-            scored_posts.append((post, score))
-
-        # Сортируем по убыванию релевантности
-        scored_posts.sort(key=lambda x: x[1], reverse=True)
-
-        # Берем топ-5 постов
-        top_posts = scored_posts[:5]
+        # Берем топ-5 постов из ленты пользователя без полной сортировки
+        snapshot = feed.user_snapshot(user, depth=5)
 
         # Формируем ответ
-        feed_posts = []
-        for post, score in top_posts:
-            post_data = post.to_dict()
-            post_data['relevance_score'] = round(score, 3)
-            feed_posts.append(post_data)
+        feed_posts = serializers.serialize_page(snapshot.page(0, 5))
 
         return jsonify({
             "posts": feed_posts,
@@ -1110,9 +1210,8 @@ def like_post(post_id):
         if not user or not post:
             return jsonify({"error": "Пользователь или пост не найден"}), 404
 
-        # Обновляем метрики ленты
-        user.update_feed_metrics(post, 'like')
-        db.session.commit()
+        # Метрики ленты обновятся при ближайшем сбросе очереди
+        metrics_queue.queue.push(user.id, post, feed_action='like')
 
         return jsonify({
             "message": "Пост лайкнут",
@@ -1124,6 +1223,96 @@ def like_post(post_id):
         return jsonify({"error": str(e)}), 500
 
 
+@bp.route('/api/interactions/batch', methods=['POST'])
+@jwt_required()
+def log_interactions_batch():
+    """Пачка взаимодействий из приложения: журнал одной вставкой, счётчики ленты одной записью"""
+    try:
+        user_id = get_jwt_identity()
+        data = request.get_json(silent=True) or {}
+        events = data.get('events')
+
+        if not isinstance(events, list) or not events:
+            return jsonify({"error": "Отсутствует список events"}), 400
+        if len(events) > constants.MAX_INTERACTION_BATCH:
+            return jsonify({"error": f"Не больше {constants.MAX_INTERACTION_BATCH} событий за запрос"}), 400
+
+        now = datetime.now()
+        rows = []
+        rejected = 0
+        for event in events:
+            try:
+                post_type = event.get('post_type', 'event')
+                action = event['type']
+                if post_type not in ('event', 'post') or action not in models.INTERACTION_TYPES:
+                    raise ValueError(action)
+                created_at = now
+                if event.get('timestamp'):
+                    created_at = datetime.fromisoformat(event['timestamp'].replace('Z', '+00:00'))
+                    if created_at.tzinfo is not None:
+                        created_at = created_at.astimezone().replace(tzinfo=None)
+                rows.append({
+                    'user_id': user_id,
+                    'post_type': post_type,
+                    'post_id': int(event['post_id']),
+                    'type': action,
+                    'value': float(event.get('value', 1.0)),
+                    'created_at': created_at
+                })
+            except (AttributeError, KeyError, TypeError, ValueError):
+                rejected += 1
+
+        # Отбрасываем события по несуществующим постам: один IN-запрос на таблицу
+        known = set()
+        for post_type, model in (('event', PostEvent), ('post', PostSimple)):
+            ids = {row['post_id'] for row in rows if row['post_type'] == post_type}
+            if ids:
+                known.update((post_type, post_id)
+                             for post_id, in db.session.query(model.id).filter(model.id.in_(ids)))
+        accepted = [row for row in rows if (row['post_type'], row['post_id']) in known]
+        rejected += len(rows) - len(accepted)
+
+        if accepted:
+            # Список параметров - один executemany
+            db.session.execute(db.insert(InteractionLog), accepted)
+            # Показы попадают в фильтр просмотренных, лента их больше не отдаёт
+            shown = [(row['post_type'], row['post_id']) for row in accepted if row['type'] == 'impression']
+            if shown:
+                seen.record_impressions(int(user_id), shown, now)
+            db.session.commit()
+
+            accepted.sort(key=lambda row: row['created_at'])
+            interactions = [(row['type'], row['value']) for row in accepted
+                            if row['type'] in models.FEED_STAT_ACTIONS]
+            if interactions:
+                try:
+                    updated = metrics_queue.queue.update(
+                        user_id, lambda user: user.update_feed_stats(interactions))
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"ERROR: Счётчики ленты пользователя {user_id} не обновлены: {e}")
+                    updated = False
+                if not updated:
+                    # Журнал уже сохранён, поэтому ответ говорит, сколько принято:
+                    # повтор всей пачки продублировал бы записи журнала
+                    return jsonify({
+                        "error": "Взаимодействия сохранены, но счётчики ленты не обновлены",
+                        "accepted": len(accepted),
+                        "rejected": rejected,
+                        "feed_stats_updated": False
+                    }), 500
+
+        return jsonify({
+            "message": "Взаимодействия сохранены",
+            "accepted": len(accepted),
+            "rejected": rejected
+        }), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+
 @bp.route('/api/users', methods=['GET'])
 def get_users():
     users = User.query.all()
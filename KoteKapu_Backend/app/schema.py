@@ -0,0 +1,136 @@
+"""Обновление схемы существующей базы без её пересоздания (manage.py --upgrade-db)"""
+
+import json
+
+from . import counters
+from . import tags
+from .extensions import db
+from .models import UserTagWeight, FEED_STATS_DIMENSION, split_feed_metrics
+from .scoring import projected_rows
+
+# Прежние JSON-столбцы метрик в таблице user и измерения, в которые они переезжают
+LEGACY_METRIC_COLUMNS = {
+    'interests_metrics': 'interests',
+    'format_metrics': 'formats',
+    'event_type_metrics': 'event_types',
+    'feed_metrics': None,
+}
+
+BACKFILL_BATCH = 1000
+
+
+def table_columns(table):
+    return {column['name'] for column in db.inspect(db.engine).get_columns(table)}
+
+
+def add_missing_columns():
+    """Добавляет в существующие таблицы столбцы, появившиеся в моделях
+
+    create_all создаёт только новые таблицы. Новые столбцы должны иметь
+    server_default или допускать NULL, чтобы заполнить уже существующие строки.
+    """
+    inspector = db.inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f'{column.name} {column.type.compile(db.engine.dialect)}'
+                default = getattr(column.server_default, 'arg', None)
+                if isinstance(default, str):
+                    ddl += f" DEFAULT '{default}'"
+                if not column.nullable:
+                    ddl += ' NOT NULL'
+                connection.execute(
+                    db.text(f'ALTER TABLE "{table.name}" ADD COLUMN {ddl}'))
+                added.append(f'{table.name}.{column.name}')
+    return added
+
+
+def legacy_metric_rows(column, raw):
+    """Строки (измерение, тег, вес) из значения прежнего JSON-столбца"""
+    metrics = json.loads(raw) if raw else {}
+    dimension = LEGACY_METRIC_COLUMNS[column]
+    if dimension is None:
+        dimensions = split_feed_metrics(metrics)
+    else:
+        dimensions = {dimension: metrics}
+    for dimension, weights in dimensions.items():
+        for tag, weight in weights.items():
+            yield dimension, tag, float(weight or 0.0)
+
+
+def backfill_tag_weights():
+    """Переносит метрики из JSON-столбцов user в user_tag_weight
+
+    Пользователи, у которых строки уже есть, пропускаются, поэтому запуск
+    можно повторять. Сами столбцы остаются в таблице для отката.
+    """
+    existing = table_columns('user')
+    legacy = [column for column in LEGACY_METRIC_COLUMNS if column in existing]
+    if not legacy:
+        return 0
+
+    migrated = {user_id for user_id, in
+                db.session.query(UserTagWeight.user_id).distinct()}
+    result = db.session.execute(
+        db.text(f'SELECT id, {", ".join(legacy)} FROM "user" ORDER BY id'))
+
+    users = 0
+    batch = []
+    for user_id, *values in result.all():
+        if user_id in migrated:
+            continue
+        users += 1
+        for column, raw in zip(legacy, values):
+            batch.extend(
+                {'user_id': user_id, 'dimension': dimension, 'tag': tag,
+                 'weight': weight}
+                for dimension, tag, weight in legacy_metric_rows(column, raw)
+            )
+        if len(batch) >= BACKFILL_BATCH:
+            db.session.execute(db.insert(UserTagWeight), batch)
+            batch = []
+    if batch:
+        db.session.execute(db.insert(UserTagWeight), batch)
+    db.session.commit()
+    return users
+
+
+def backfill_tags():
+    """Заполняет словарь tag тегами постов и метрик пользователей"""
+    names = set()
+    for _, _, interest_tags, format_tags, event_type in projected_rows():
+        names.update(interest_tags)
+        names.update(format_tags)
+        if event_type:
+            names.add(event_type)
+    names.update(tag for tag, in db.session.query(UserTagWeight.tag).filter(
+        UserTagWeight.dimension != FEED_STATS_DIMENSION).distinct())
+
+    known = len(tags.vocabulary)
+    tags.vocabulary.intern_all(sorted(names))
+    return len(tags.vocabulary) - known
+
+
+def upgrade_schema():
+    """Создаёт недостающие таблицы и переносит данные
+
+    Вызывается в контексте приложения.
+    """
+    db.create_all()
+    added = add_missing_columns()
+    for column in added:
+        print(f"✅ ДОБАВЛЕН СТОЛБЕЦ {column}")
+    # Новые столбцы счётчиков заполнены нулями - считаем их по таблицам связей
+    if any(column in added for column in counters.COUNTER_COLUMNS):
+        counters.repair_counters()
+    users = backfill_tag_weights()
+    if users:
+        print(f"✅ МЕТРИКИ ПЕРЕНЕСЕНЫ В user_tag_weight: {users} пользователей")
+    backfill_tags()
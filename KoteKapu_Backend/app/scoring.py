@@ -0,0 +1,323 @@
+"""Векторный движок ранжирования ленты рекомендаций"""
+
+import json
+import threading
+from array import array
+
+import numpy as np
+from flask import current_app
+
+from . import tags
+from .catalog import catalog
+from .extensions import db
+from .models import PostEvent, PostSimple
+
+# Веса из PostEvent.calculate_relevance_score: (анкета, лента) по измерениям
+EVENT_WEIGHTS = {
+    'interest': (0.3, 0.1),
+    'format': (0.25, 0.1),
+    'event_type': (0.2, 0.05),
+}
+
+# Веса из PostSimple.calculate_relevance_score (усредняются по числу тегов)
+SIMPLE_WEIGHTS = {
+    'interest': (0.5, 0.1),
+    'format': (0.3, 0.1),
+}
+
+# Округляем, чтобы матричный и поэлементный расчёт давали одинаковый порядок
+SCORE_DECIMALS = 12
+
+
+def top_k(scores, k):
+    """Индексы k лучших постов по убыванию оценки, при равенстве - в порядке каталога"""
+    total = len(scores)
+    if k <= 0 or total == 0:
+        return np.zeros(0, dtype=np.intp)
+    if k >= total:
+        return np.argsort(-scores, kind='stable')
+
+    # Частичный отбор за O(n): упорядочиваем только k выбранных элементов
+    threshold = np.partition(scores, total - k)[total - k]
+    above = np.flatnonzero(scores > threshold)
+    ties = np.flatnonzero(scores == threshold)[:k - len(above)]
+    selected = np.concatenate([above, ties])
+    return selected[np.lexsort((selected, -scores[selected]))]
+
+
+def post_features(kind, interest_tags, format_tags, event_type):
+    """Возвращает список (измерение, тег, вес анкеты, вес ленты) для поста"""
+    features = []
+    tagged = (('interest', interest_tags), ('format', format_tags))
+
+    if kind == 'event':
+        for dimension, dimension_tags in tagged:
+            survey_weight, feed_weight = EVENT_WEIGHTS[dimension]
+            for tag in dimension_tags:
+                features.append((dimension, tag, survey_weight, feed_weight))
+        if event_type:
+            survey_weight, feed_weight = EVENT_WEIGHTS['event_type']
+            features.append(('event_type', event_type, survey_weight, feed_weight))
+    else:
+        for dimension, dimension_tags in tagged:
+            survey_weight, feed_weight = SIMPLE_WEIGHTS[dimension]
+            share = len(dimension_tags)
+            for tag in dimension_tags:
+                features.append(
+                    (dimension, tag, survey_weight / share, feed_weight / share))
+
+    return features
+
+
+def score_features(features, preferences):
+    """Оценка одного поста по его признакам и вектору предпочтений пользователя"""
+    metrics = preferences.dimensions()
+    total = 0.0
+    for dimension, tag, survey_weight, feed_weight in features:
+        survey, feed = metrics[dimension]
+        total += survey.get(tag, 0.0) * survey_weight + feed.get(tag, 0.0) * feed_weight
+    return round(total, SCORE_DECIMALS)
+
+
+def post_rows(posts):
+    """Преобразует ORM-посты в строки (тип, id, интересы, форматы, тип события)"""
+    for post in posts:
+        if isinstance(post, PostEvent):
+            yield ('event', post.id, post.get_interest_tags(), post.get_format_tags(),
+                   post.event_type)
+        else:
+            yield ('post', post.id, post.get_interest_tags() or [],
+                   post.get_format_tags() or [], None)
+
+
+def projected_rows():
+    """Строки для движка из проекции нужных столбцов, без построения ORM-объектов"""
+    events = db.session.query(
+        PostEvent.id, PostEvent.interest_tags, PostEvent.format_tags,
+        PostEvent.event_type
+    ).order_by(PostEvent.id)
+    for post_id, interest_tags, format_tags, event_type in events:
+        yield ('event', post_id, json.loads(interest_tags or '[]'),
+               json.loads(format_tags or '[]'), event_type)
+
+    simple = db.session.query(
+        PostSimple.id, PostSimple.interest_tags, PostSimple.format_tags
+    ).order_by(PostSimple.id)
+    for post_id, interest_tags, format_tags in simple:
+        yield ('post', post_id, json.loads(interest_tags or '[]'),
+               json.loads(format_tags or '[]'), None)
+
+
+class ScoringEngine:
+    """Разреженная матрица пост x тег
+
+    Релевантность всего каталога считается за один проход по ней.
+    """
+
+    def __init__(self, rows, interned=False):
+        """Строит матрицу по строкам (тип, id, интересы, форматы, тип события)
+
+        interned=True - теги в строках уже id из tags.vocabulary (записи каталога).
+        """
+        self.keys = []
+        # (измерение, id тега) -> столбец матрицы
+        self.columns = {}
+        # Ненулевые элементы матрицы плоскими массивами вместо списка кортежей
+        entry_rows = array('I')
+        entry_columns = array('I')
+        entry_survey = array('d')
+        entry_feed = array('d')
+
+        for kind, post_id, interest_tags, format_tags, event_type in rows:
+            row = len(self.keys)
+            self.keys.append((kind, post_id))
+            features = post_features(kind, interest_tags, format_tags, event_type)
+            tag_ids = [tag for _, tag, _, _ in features]
+            if not interned:
+                tag_ids = tags.vocabulary.intern_all(tag_ids)
+            for feature, tag_id in zip(features, tag_ids):
+                dimension, _, survey_weight, feed_weight = feature
+                column = self.columns.setdefault((dimension, tag_id), len(self.columns))
+                entry_rows.append(row)
+                entry_columns.append(column)
+                entry_survey.append(survey_weight)
+                entry_feed.append(feed_weight)
+
+        # Разреженная матрица в CSR: элементы уже идут по строкам, indptr[row] -
+        # начало строки. Плотная заняла бы посты x теги, почти целиком нули
+        width = len(self.columns)
+        entry_rows = np.asarray(entry_rows, dtype=np.intp)
+        entry_columns = np.asarray(entry_columns, dtype=np.intp)
+        self.entry_rows = entry_rows
+        self.indptr = np.searchsorted(entry_rows, np.arange(len(self.keys) + 1))
+        self.indices = entry_columns
+        self.survey = np.asarray(entry_survey)
+        self.feed = np.asarray(entry_feed)
+
+        # Инвертированный индекс: столбец (измерение, тег) -> строки постов с этим тегом
+        order = np.lexsort((entry_rows, entry_columns))
+        bounds = np.searchsorted(entry_columns[order], np.arange(width + 1))
+        self.postings = [np.unique(entry_rows[order[start:end]])
+                         for start, end in zip(bounds[:-1], bounds[1:])]
+
+        # Для каждого измерения: id тега -> столбец (-1, если в каталоге тега нет)
+        self.tag_columns = {}
+        for (dimension, tag_id), column in self.columns.items():
+            index = self.tag_columns.setdefault(dimension, {})
+            index[tag_id] = column
+        for dimension, index in self.tag_columns.items():
+            lookup = np.full(max(index) + 1, -1, dtype=np.intp)
+            lookup[list(index)] = list(index.values())
+            self.tag_columns[dimension] = lookup
+
+    @classmethod
+    def from_catalog(cls, signature):
+        # Строки из каталога в памяти процесса - без запросов к таблицам постов
+        # и без повторного интернирования тегов
+        return cls(catalog.rows(), interned=True)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def close(self):
+        """Освобождает ресурсы движка при пересборке"""
+
+    def user_vector(self, user):
+        width = len(self.columns)
+        vector = np.zeros(2 * width)
+        packed = user.get_preference_vector().packed(tags.vocabulary)
+        for dimension, halves in packed.items():
+            lookup = self.tag_columns.get(dimension)
+            if lookup is None:
+                continue
+            for offset, (tag_ids, weights) in zip((0, width), halves):
+                if not tag_ids:
+                    continue
+                tag_ids = np.asarray(tag_ids, dtype=np.intp)
+                known = tag_ids < len(lookup)
+                columns = lookup[tag_ids[known]]
+                present = columns >= 0
+                vector[offset + columns[present]] = np.asarray(weights)[known][present]
+        return vector
+
+    def _contributions(self, entries, vector):
+        """Вклад элементов матрицы entries в оценку: анкета слева, лента справа"""
+        columns = self.indices[entries]
+        width = len(self.columns)
+        return (self.survey[entries] * vector[columns]
+                + self.feed[entries] * vector[width + columns])
+
+    def score(self, user):
+        """Оценки релевантности всех постов в порядке self.keys за O(ненулевых)"""
+        if not self.keys:
+            return np.zeros(0)
+        contributions = self._contributions(slice(None), self.user_vector(user))
+        scores = np.bincount(self.entry_rows, contributions, minlength=len(self.keys))
+        return np.round(scores, SCORE_DECIMALS)
+
+    def top(self, user, k):
+        """Готовый топ [((тип, id), оценка)] из k постов"""
+        scores = self.score(user)
+        return [(self.keys[row], float(scores[row])) for row in top_k(scores, k)]
+
+    # Обычный движок отдаёт оценки всего каталога, а не только готовый топ
+    top_only = False
+
+    def score_candidates(self, user):
+        """Оценивает только посты, делящие с пользователем хотя бы один тег
+
+        Возвращает (строки по возрастанию, их оценки). У остальных постов оценка
+        ровно 0, поэтому их можно не считать.
+        """
+        vector = self.user_vector(user)
+        width = len(self.columns)
+        active = np.flatnonzero(vector[:width] + vector[width:])
+        if not len(active):
+            return np.zeros(0, dtype=np.intp), np.zeros(0)
+
+        rows = np.unique(np.concatenate([self.postings[column] for column in active]))
+        # Элементы строк-кандидатов подряд: начало строки плюс сдвиг внутри неё
+        starts = self.indptr[rows]
+        lengths = self.indptr[rows + 1] - starts
+        offsets = np.cumsum(lengths) - lengths
+        entries = np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+        local = np.repeat(np.arange(len(rows)), lengths)
+        contributions = self._contributions(entries, vector)
+        scores = np.bincount(local, contributions, minlength=len(rows))
+        scores = np.round(scores, SCORE_DECIMALS)
+        positive = scores > 0
+        return rows[positive], scores[positive]
+
+
+_engine = None
+_engine_signature = None
+# Пересборка и замена движка из потоков одного воркера
+_engine_lock = threading.Lock()
+
+
+def catalog_signature():
+    """Отпечаток каталога - его catalog_version (см. catalog.py)"""
+    return catalog.refresh()
+
+
+def signature_key(signature):
+    """Отпечаток каталога в виде строки для хранения в БД"""
+    return json.dumps(signature)
+
+
+def get_engine(signature=None):
+    """Возвращает движок текущего процесса, пересобирая его при изменении каталога"""
+    global _engine, _engine_signature
+
+    if signature is None:
+        signature = catalog_signature()
+    with _engine_lock:
+        if _engine is None or signature != _engine_signature:
+            previous = _engine
+            _engine = engine_class().from_catalog(signature)
+            _engine_signature = signature
+            if previous is not None:
+                # Потоки, уже получившие старый движок, могут ещё считать по нему:
+                # close() освобождает ресурсы только после их завершения
+                previous.close()
+        return _engine
+
+
+def engine_class():
+    """Класс движка по настройке FEED_SCORING_BACKEND"""
+    backend = current_app.config.get('FEED_SCORING_BACKEND', 'numpy')
+    if backend == 'parallel':
+        from .parallel_scoring import ParallelScoringEngine
+        return ParallelScoringEngine
+    if backend == 'sql':
+        from .sql_scoring import SqlScoringEngine
+        return SqlScoringEngine
+    return ScoringEngine
+
+
+def invalidate_engine():
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            _engine.close()
+        _engine = None
+
+
+def load_posts(keys, options=None):
+    """Загружает посты страницы по ключам (тип, id): один IN-запрос на таблицу
+
+    options - {тип: опция запроса}, например load_only для выбранных полей.
+    """
+    ids = {'event': [], 'post': []}
+    for kind, post_id in keys:
+        ids[kind].append(post_id)
+
+    posts = {}
+    for kind, model in (('event', PostEvent), ('post', PostSimple)):
+        if ids[kind]:
+            query = model.query.filter(model.id.in_(ids[kind]))
+            if options and kind in options:
+                query = query.options(options[kind])
+            for post in query.all():
+                posts[(kind, post.id)] = post
+    return posts
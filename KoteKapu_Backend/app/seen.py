@@ -0,0 +1,97 @@
+"""Просмотренные посты пользователя: фильтр Блума из двух поколений в BLOB
+
+Показы из POST /api/interactions/batch добавляются в текущее поколение.
+Когда оно заполнено или устарело, оно становится предыдущим, а старое
+предыдущее отбрасывается - так показы истекают без отдельной очистки.
+Лента пропускает посты, которые есть в любом из поколений.
+"""
+
+import hashlib
+from datetime import datetime, timedelta
+
+from .extensions import db
+from .models import UserSeenFilter
+
+# 2048 бит = 256 байт на поколение; 4 хеша дают ~1% ложных срабатываний
+# на SEEN_GENERATION_CAPACITY постах
+SEEN_FILTER_BITS = 2048
+SEEN_FILTER_HASHES = 4
+SEEN_GENERATION_CAPACITY = 200
+SEEN_GENERATION_TTL = timedelta(days=3)
+
+
+def post_bits(key):
+    """Номера битов поста (тип, id): двойное хеширование одного blake2b"""
+    kind, post_id = key
+    digest = hashlib.blake2b(f'{kind}:{post_id}'.encode('ascii'),
+                             digest_size=8).digest()
+    first = int.from_bytes(digest[:4], 'little')
+    second = int.from_bytes(digest[4:], 'little') | 1
+    return [(first + i * second) % SEEN_FILTER_BITS for i in range(SEEN_FILTER_HASHES)]
+
+
+def _contains(bits, key):
+    return bits is not None and all(bits[bit >> 3] & (1 << (bit & 7))
+                                    for bit in post_bits(key))
+
+
+class SeenFilter:
+    """Проверка «пост уже показан» по обоим поколениям фильтра"""
+
+    def __init__(self, current=None, previous=None, count=0):
+        self.current = current
+        self.previous = previous
+        # Сколько показов в обоих поколениях - верхняя граница числа пропусков в ленте
+        self.count = count
+
+    @classmethod
+    def for_user(cls, user_id, now=None):
+        """Фильтр пользователя без поколений, истёкших с последней ротации
+
+        Без новых показов ротация не происходит, поэтому срок проверяется и
+        при чтении: предыдущее поколение отброшено бы при следующей ротации
+        через SEEN_GENERATION_TTL, текущее - ещё через один TTL.
+        """
+        row = db.session.get(UserSeenFilter, user_id)
+        if row is None:
+            return cls()
+        age = (now or datetime.now()) - row.rotated_at
+        if age > 2 * SEEN_GENERATION_TTL:
+            return cls()
+        if age > SEEN_GENERATION_TTL:
+            return cls(row.current, None, row.current_count)
+        return cls(row.current, row.previous, row.current_count + row.previous_count)
+
+    def __bool__(self):
+        return self.count > 0
+
+    def __contains__(self, key):
+        return _contains(self.current, key) or _contains(self.previous, key)
+
+
+def record_impressions(user_id, keys, now=None):
+    """Добавляет показанные посты в фильтр пользователя; коммит - за вызывающим"""
+    now = now or datetime.now()
+    row = db.session.get(UserSeenFilter, user_id)
+    if row is None:
+        row = UserSeenFilter(user_id=user_id, current=bytes(SEEN_FILTER_BITS // 8),
+                             current_count=0, previous_count=0, rotated_at=now)
+        db.session.add(row)
+
+    current = bytearray(row.current)
+    for key in dict.fromkeys(keys):
+        if _contains(current, key):
+            continue
+        if (row.current_count >= SEEN_GENERATION_CAPACITY
+                or now - row.rotated_at > SEEN_GENERATION_TTL):
+            # Ротация: текущее поколение становится предыдущим,
+            # самое старое отбрасывается
+            row.previous = bytes(current)
+            row.previous_count = row.current_count
+            row.current_count = 0
+            row.rotated_at = now
+            current = bytearray(SEEN_FILTER_BITS // 8)
+        for bit in post_bits(key):
+            current[bit >> 3] |= 1 << (bit & 7)
+        row.current_count += 1
+    row.current = bytes(current)
@@ -0,0 +1,194 @@
+"""Сериализация списков постов без запросов на каждый пост
+
+PostEvent.to_dict() и PostSimple.to_dict() по отдельности читают организацию
+и автора. Для страницы из N постов это до 2N запросов; serialize_posts
+загружает то же самое одним IN-запросом на таблицу и отдаёт в to_dict,
+поэтому JSON не меняется. Счётчики лайков и регистраций хранятся в самих
+постах (см. counters.py).
+
+Списки постов поддерживают выбор полей: ?fields=id,title,pic или
+?view=compact. Тогда из таблиц постов читаются только нужные столбцы
+(остальные отложены через load_only), а в ответ попадают только
+запрошенные поля с теми же значениями, что и в полном to_dict().
+"""
+
+from . import scoring
+from .extensions import db
+from .models import Organisation, User, PostEvent, PostSimple
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def _organisation_data(organisation):
+    if not organisation:
+        return None
+    return {'id': organisation.id, 'title': organisation.title,
+            'avatar': organisation.avatar}
+
+
+def _author_data(author):
+    if not author:
+        return None
+    return {'id': author.id, 'first_name': author.first_name,
+            'last_name': author.last_name, 'avatar': author.avatar}
+
+
+def _organisation_field(name):
+    def value(post, related):
+        return getattr(related.organisations.get(post.organization_id), name, None)
+    return value
+
+
+# Поле ответа -> (столбцы модели для него, значение из поста и PostRelations).
+# Значения повторяют PostEvent.to_dict() и PostSimple.to_dict()
+EVENT_FIELDS = {
+    'id': ((), lambda post, related: post.id),
+    'title': (('title',), lambda post, related: post.title),
+    'description': (('description',), lambda post, related: post.description),
+    'date_time': (('date_time',), lambda post, related: _iso(post.date_time)),
+    'created_at': (('created_at',), lambda post, related: _iso(post.created_at)),
+    'pic': (('pic',), lambda post, related: post.pic),
+    'location': (('location',), lambda post, related: post.location),
+    'event_type': (('event_type',), lambda post, related: post.event_type),
+    'interest_tags': (('interest_tags',),
+                      lambda post, related: post.get_interest_tags()),
+    'format_tags': (('format_tags',), lambda post, related: post.get_format_tags()),
+    'organization_id': (('organization_id',),
+                        lambda post, related: post.organization_id),
+    'organization_name': (('organization_id',), _organisation_field('title')),
+    'organization_avatar': (('organization_id',), _organisation_field('avatar')),
+    'type': ((), lambda post, related: 'event'),
+    'likes': (('likes_count',), lambda post, related: post.likes_count or 0),
+    'registered_count': (('registered_count',),
+                         lambda post, related: post.registered_count or 0),
+}
+
+POST_FIELDS = {
+    'id': ((), lambda post, related: post.id),
+    'title': (('title',), lambda post, related: post.title),
+    'description': (('description',), lambda post, related: post.description),
+    'created_at': (('created_at',), lambda post, related: _iso(post.created_at)),
+    'pic': (('pic',), lambda post, related: post.pic),
+    'interest_tags': (('interest_tags',),
+                      lambda post, related: post.get_interest_tags()),
+    'format_tags': (('format_tags',), lambda post, related: post.get_format_tags()),
+    'organization_id': (('organization_id',),
+                        lambda post, related: post.organization_id),
+    'organization': (('organization_id',), lambda post, related: _organisation_data(
+        related.organisations.get(post.organization_id))),
+    # В полном ответе у простого поста организация только вложенным объектом;
+    # компактной карточке нужно плоское имя, как у мероприятий
+    'organization_name': (('organization_id',), _organisation_field('title')),
+    'author_id': (('author_id',), lambda post, related: post.author_id),
+    'author': (('author_id',),
+               lambda post, related: _author_data(related.authors.get(post.author_id))),
+    'type': ((), lambda post, related: 'post'),
+}
+
+# Карточка списка в приложении: заголовок, картинка, дата и организация
+COMPACT_FIELDS = frozenset({'id', 'type', 'title', 'pic', 'date_time', 'created_at',
+                            'organization_name'})
+# Без них клиент не отличит мероприятие от поста с тем же id
+REQUIRED_FIELDS = frozenset({'id', 'type'})
+KNOWN_FIELDS = frozenset(EVENT_FIELDS) | frozenset(POST_FIELDS)
+ORGANISATION_FIELDS = frozenset({'organization', 'organization_name',
+                                 'organization_avatar'})
+
+
+def parse_fields(args):
+    """Набор полей из ?fields=a,b и/или ?view=compact; None - полный ответ
+
+    Бросает ValueError с перечнем неизвестных полей.
+    """
+    view = args.get('view') or 'full'
+    if view not in ('full', 'compact'):
+        raise ValueError(f"Неизвестный view: {view}")
+
+    fields = set(COMPACT_FIELDS) if view == 'compact' else set()
+    if args.get('fields'):
+        requested = {name.strip() for name in args['fields'].split(',')
+                     if name.strip()}
+        unknown = requested - KNOWN_FIELDS
+        if unknown:
+            raise ValueError(f"Неизвестные поля: {', '.join(sorted(unknown))}")
+        fields |= requested
+    return frozenset(fields | REQUIRED_FIELDS) if fields else None
+
+
+def _field_table(model):
+    return EVENT_FIELDS if model is PostEvent else POST_FIELDS
+
+
+def load_only(model, fields):
+    """Опция запроса: загрузить только столбцы, нужные для полей fields"""
+    table = _field_table(model)
+    columns = sorted({column for name in fields if name in table
+                      for column in table[name][0]})
+    return db.load_only(model.id, *(getattr(model, column) for column in columns))
+
+
+class PostRelations:
+    """Организации и авторы для пачки постов; fields ограничивает, что загружать"""
+
+    def __init__(self, posts, fields=None):
+        organisation_ids = set()
+        if fields is None or fields & ORGANISATION_FIELDS:
+            organisation_ids = {post.organization_id for post in posts
+                                if post.organization_id}
+        author_ids = set()
+        if fields is None or 'author' in fields:
+            author_ids = {post.author_id for post in posts
+                          if isinstance(post, PostSimple) and post.author_id}
+
+        # Только нужные столбцы: полная загрузка User подтянула бы
+        # ещё и его метрики
+        self.organisations = {}
+        if organisation_ids:
+            self.organisations = {row.id: row for row in db.session.query(
+                Organisation.id, Organisation.title, Organisation.avatar
+            ).filter(Organisation.id.in_(organisation_ids))}
+
+        self.authors = {}
+        if author_ids:
+            self.authors = {row.id: row for row in db.session.query(
+                User.id, User.first_name, User.last_name, User.avatar
+            ).filter(User.id.in_(author_ids))}
+
+
+def _sparse(post, fields, related):
+    table = _field_table(type(post))
+    return {name: table[name][1](post, related)
+            for name in sorted(fields) if name in table}
+
+
+def serialize_posts(posts, fields=None):
+    """Список словарей to_dict() для постов обоих типов
+
+    На весь список уходит 2 запроса.
+
+    fields - набор полей из parse_fields; None - полный to_dict().
+    """
+    posts = list(posts)
+    related = PostRelations(posts, fields)
+    if fields is None:
+        return [post.to_dict(related) for post in posts]
+    return [_sparse(post, fields, related) for post in posts]
+
+
+def serialize_page(page, fields=None):
+    """Посты страницы ленты [((тип, id), оценка)] с relevance_score
+
+    Удалённые посты пропускаются.
+    """
+    options = None
+    if fields is not None:
+        options = {'event': load_only(PostEvent, fields),
+                   'post': load_only(PostSimple, fields)}
+    posts = scoring.load_posts([key for key, _ in page], options)
+    ranked = [(posts[key], score) for key, score in page if key in posts]
+    result = serialize_posts((post for post, _ in ranked), fields)
+    for post_data, (_, score) in zip(result, ranked):
+        post_data['relevance_score'] = round(score, 3)
+    return result
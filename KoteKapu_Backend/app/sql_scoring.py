@@ -0,0 +1,121 @@
+"""Расчёт релевантности внутри SQLite через расширение JSON1
+
+Формула PostEvent/PostSimple.calculate_relevance_score собрана в один
+SQL-запрос: теги постов разворачиваются json_each и соединяются с весами
+пользователя, переданными одним JSON-параметром. Сортировка и LIMIT/OFFSET
+выполняются в базе, в Python попадает только страница.
+"""
+
+import json
+
+from sqlalchemy import text
+
+from .catalog import catalog
+from .extensions import db
+from .scoring import EVENT_WEIGHTS, SIMPLE_WEIGHTS, SCORE_DECIMALS
+
+
+def _tag_sum(tags_column, weights_path):
+    """Сумма весов пользователя по тегам поста (повторы тега считаются каждый раз)"""
+    return (
+        f"(SELECT COALESCE(SUM(w.value), 0) "
+        f"FROM json_each(COALESCE({tags_column}, '[]')) t "
+        f"JOIN json_each(:weights, '{weights_path}') w ON w.key = t.value)"
+    )
+
+
+def _type_weight(weights_path):
+    return (
+        f"COALESCE((SELECT w.value FROM json_each(:weights, '{weights_path}') w "
+        f"WHERE w.key = p.event_type), 0)"
+    )
+
+
+def _count(tags_column):
+    # Для постов без тегов сумма и так 0, делим на 1, чтобы не получить NULL
+    return f"MAX(json_array_length(COALESCE({tags_column}, '[]')), 1)"
+
+
+EVENT_SCORE = " + ".join([
+    f"{EVENT_WEIGHTS['interest'][0]} * {_tag_sum('p.interest_tags', '$.interests')}",
+    f"{EVENT_WEIGHTS['format'][0]} * {_tag_sum('p.format_tags', '$.formats')}",
+    f"{EVENT_WEIGHTS['event_type'][0]} * {_type_weight('$.event_types')}",
+    f"{EVENT_WEIGHTS['interest'][1]} * "
+    f"{_tag_sum('p.interest_tags', '$.preferred_categories')}",
+    f"{EVENT_WEIGHTS['format'][1]} * "
+    f"{_tag_sum('p.format_tags', '$.preferred_formats')}",
+    f"{EVENT_WEIGHTS['event_type'][1]} * {_type_weight('$.preferred_event_types')}",
+])
+
+SIMPLE_SCORE = " + ".join([
+    f"{SIMPLE_WEIGHTS['interest'][0]} * "
+    f"{_tag_sum('p.interest_tags', '$.interests')} / {_count('p.interest_tags')}",
+    f"{SIMPLE_WEIGHTS['format'][0]} * "
+    f"{_tag_sum('p.format_tags', '$.formats')} / {_count('p.format_tags')}",
+    f"{SIMPLE_WEIGHTS['interest'][1]} * "
+    f"{_tag_sum('p.interest_tags', '$.preferred_categories')}"
+    f" / {_count('p.interest_tags')}",
+    f"{SIMPLE_WEIGHTS['format'][1]} * "
+    f"{_tag_sum('p.format_tags', '$.preferred_formats')}"
+    f" / {_count('p.format_tags')}",
+])
+
+# kind_order и id повторяют порядок каталога при равных оценках,
+# как стабильная сортировка
+RANKING_SQL = text(f"""
+    SELECT kind, id, score FROM (
+        SELECT 'event' AS kind, 0 AS kind_order, p.id AS id,
+               ROUND({EVENT_SCORE}, {SCORE_DECIMALS}) AS score
+        FROM post_event p
+        UNION ALL
+        SELECT 'post' AS kind, 1 AS kind_order, p.id AS id,
+               ROUND({SIMPLE_SCORE}, {SCORE_DECIMALS}) AS score
+        FROM post_simple p
+    )
+    ORDER BY score DESC, kind_order, id
+    LIMIT :limit OFFSET :offset
+""")
+
+
+def user_weights(user):
+    """Веса пользователя одним JSON-документом для параметра :weights"""
+    preferences = user.get_preference_vector()
+    return json.dumps({
+        'interests': preferences.interests,
+        'formats': preferences.formats,
+        'event_types': preferences.event_types,
+        'preferred_categories': preferences.preferred_categories,
+        'preferred_formats': preferences.preferred_formats,
+        'preferred_event_types': preferences.preferred_event_types,
+    }, ensure_ascii=False)
+
+
+class SqlScoringEngine:
+    """Движок с интерфейсом ScoringEngine, ранжирующий каталог в SQLite"""
+
+    top_only = True
+
+    def __init__(self, total):
+        self.total = total
+
+    @classmethod
+    def from_catalog(cls, signature):
+        return cls(len(catalog))
+
+    def __len__(self):
+        return self.total
+
+    def close(self):
+        pass
+
+    def rank(self, user, offset, limit):
+        """Страница [((тип, id), оценка)], отсортированная базой"""
+        rows = db.session.execute(RANKING_SQL, {
+            'weights': user_weights(user),
+            'limit': limit,
+            'offset': offset,
+        })
+        return [((kind, post_id), float(score)) for kind, post_id, score in rows]
+
+    def top(self, user, k):
+        return self.rank(user, 0, k)
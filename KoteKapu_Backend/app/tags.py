@@ -0,0 +1,81 @@
+"""Интернирование тегов: строки тегов заменяются целочисленными id из таблицы tag"""
+
+import threading
+from array import array
+
+from sqlalchemy.exc import IntegrityError
+
+from .extensions import db
+from .models import Tag
+
+
+class TagVocabulary:
+    """Карта тег -> id процесса, синхронизированная с таблицей tag
+
+    Словарь только растёт, поэтому его размер служит версией: упакованные
+    векторы пользователей пересобираются, когда он увеличивается.
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._names = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def id_for(self, name):
+        """id тега или None, если тега нет ни в одном посте каталога"""
+        return self._ids.get(name)
+
+    def names(self, tag_ids):
+        """Строки тегов по их id (обратно к intern_all)"""
+        return [self._names[tag_id] for tag_id in tag_ids]
+
+    def _load(self, connection, names=None):
+        query = db.select(Tag.id, Tag.name)
+        if names is not None:
+            query = query.where(Tag.name.in_(names))
+        for tag_id, name in connection.execute(query):
+            self._ids[name] = tag_id
+            self._names[tag_id] = name
+
+    def intern_all(self, names):
+        """id тегов по порядку, новые теги добавляются в таблицу tag"""
+        missing = {name for name in names if name not in self._ids}
+        if missing:
+            with self._lock:
+                # Отдельное соединение: словарь фиксируется сразу, даже если
+                # транзакция запроса, который его пополнил, будет откатана
+                with db.engine.begin() as connection:
+                    if not self._ids:
+                        self._load(connection)
+                    else:
+                        self._load(connection, missing)
+                    for name in sorted(missing - self._ids.keys()):
+                        try:
+                            with connection.begin_nested():
+                                connection.execute(db.insert(Tag).values(name=name))
+                        except IntegrityError:
+                            # Тот же тег только что добавил другой процесс
+                            pass
+                    self._load(connection, missing)
+        return [self._ids[name] for name in names]
+
+    def pack(self, metrics):
+        """Пара array('I') id тегов / array('d') весов для словаря метрик
+
+        Теги, которых нет в словаре, не встречаются ни в одном посте и на
+        оценку не влияют, поэтому отбрасываются вместе с нулевыми весами.
+        """
+        ids = array('I')
+        weights = array('d')
+        for name, weight in metrics.items():
+            tag_id = self._ids.get(name)
+            if tag_id is not None and weight:
+                ids.append(tag_id)
+                weights.append(weight)
+        return ids, weights
+
+
+vocabulary = TagVocabulary()
@@ -0,0 +1,177 @@
+"""Каноническая таксономия тегов: синонимы, иерархия и замыкание категория -> теги
+
+Теги приводятся к канонической форме один раз при записи (create_event,
+complete_preferences), поэтому расчёт релевантности остаётся точным
+сравнением строк без нечёткого поиска. Таблицы ниже разворачиваются
+в словари поиска при импорте модуля, то есть при старте приложения.
+"""
+
+from . import constants
+
+# Иерархия тегов: родитель -> дочерние теги (у тега может быть несколько родителей)
+TAG_CHILDREN = {
+    'IT': ['программирование', 'искусственный интеллект', 'анализ данных',
+           'кибербезопасность', 'облачные технологии', 'инфраструктура', 'DevOps',
+           'блокчейн', 'IoT', 'VR/AR'],
+    'программирование': ['Python', 'веб-разработка', 'мобильная разработка', 'геймдев',
+                         'разработка', 'тестирование'],
+    'технологии': ['IT', 'робототехника', 'облачные технологии'],
+    'инновации': ['стартапы', 'робототехника'],
+    'инжинерия': ['робототехника', 'архитектура'],
+    'блокчейн': ['NFT'],
+    'кибербезопасность': ['безопасность'],
+    'тестирование': ['качество'],
+    'искусства': ['дизайн', 'фотография', 'граффити', 'театр', 'кино', 'мода',
+                  'перформанс', 'комиксы', 'архитектура'],
+    'дизайн': ['пользовательский опыт'],
+    'культура': ['история', 'традиции', 'театр', 'музыка'],
+    'творчество': ['ремесло', 'письмо', 'музыка'],
+    'наука': ['исследования', 'биология', 'физика', 'химия', 'математика', 'астрономия',
+              'археология', 'медицина', 'экология'],
+    'биология': ['нейробиология'],
+    'астрономия': ['космос'],
+    'образование': ['языки', 'саморазвитие'],
+    'бизнес': ['стартапы', 'маркетинг', 'финансы', 'менеджмент', 'экономика'],
+    'финансы': ['инвестиции'],
+    'менеджмент': ['лидерство'],
+    'карьера': ['нетворкинг', 'саморазвитие', 'лидерство'],
+    'здоровье': ['питание', 'йога', 'медицина', 'психология', 'отдых'],
+    'спорт': ['йога'],
+    'общество': ['урбанистика', 'сообщество', 'психология', 'история'],
+    'сообщество': ['волонтерство', 'благотворительность', 'нетворкинг'],
+    'языки': ['коммуникация'],
+    'путешествия': ['отдых'],
+    'гейминг': ['геймдев', 'киберспорт'],
+    'медиа': ['блогинг', 'фотография', 'кино', 'письмо', 'маркетинг'],
+}
+
+# Категории опроса (constants.INTEREST_CATEGORIES) -> корневые теги
+CATEGORY_ROOTS = {
+    "Технологии и Инновации": ['технологии', 'инновации', 'инжинерия'],
+    "Искусство и Культура": ['искусства', 'культура', 'творчество'],
+    "Наука и Просвещение": ['наука', 'образование'],
+    "Карьера и Бизнес": ['карьера', 'бизнес'],
+    "Здоровье и Спорт": ['здоровье', 'спорт'],
+    "Волонтерство и Благотворительность": ['волонтерство', 'благотворительность',
+                                           'сообщество'],
+    "Языки и Путешествия": ['языки', 'путешествия'],
+    "Гейминг и Киберспорт": ['гейминг'],
+    "Медиа и Блогинг": ['медиа'],
+    "Общество и Урбанистика": ['общество'],
+}
+
+# Синонимы и варианты написания -> канонический тег
+TAG_SYNONYMS = {
+    'ит': 'IT', 'айти': 'IT', 'информационные технологии': 'IT',
+    'искусство': 'искусства', 'инженерия': 'инжинерия',
+    'ии': 'искусственный интеллект', 'ai': 'искусственный интеллект',
+    'машинное обучение': 'искусственный интеллект', 'ml': 'искусственный интеллект',
+    'data science': 'анализ данных', 'аналитика данных': 'анализ данных',
+    'веб': 'веб-разработка', 'web': 'веб-разработка', 'frontend': 'веб-разработка',
+    'gamedev': 'геймдев', 'разработка игр': 'геймдев', 'игры': 'гейминг',
+    'ux': 'пользовательский опыт', 'ux/ui': 'пользовательский опыт',
+    'ui/ux': 'пользовательский опыт',
+    'vr': 'VR/AR', 'ar': 'VR/AR', 'интернет вещей': 'IoT',
+    'стартап': 'стартапы', 'фото': 'фотография', 'кинематограф': 'кино',
+    'программирования': 'программирование', 'кодинг': 'программирование',
+    'волонтёрство': 'волонтерство', 'урбанизм': 'урбанистика', 'блог': 'блогинг',
+}
+
+FORMAT_SYNONYMS = {
+    'online': 'онлайн', 'offline': 'офлайн', 'оффлайн': 'офлайн', 'очно': 'офлайн',
+    'hybrid': 'гибрид', 'смешанный': 'гибрид', 'гибридный': 'гибрид',
+}
+
+EVENT_TYPE_SYNONYMS = {
+    'hackathon': 'хакатон', 'workshop': 'воркшоп', 'мастеркласс': 'мастер-класс',
+    'мастер класс': 'мастер-класс', 'meetup': 'встреча', 'митап': 'встреча',
+    'conference': 'конференция', 'lecture': 'лекция', 'festival': 'фестиваль',
+    'exhibition': 'выставка', 'concert': 'концерт', 'contest': 'конкурс',
+}
+
+
+def _lookup(canonical, synonyms):
+    """Словарь поиска: приведённая к нижнему регистру форма -> канонический тег"""
+    table = {name.casefold(): name for name in canonical}
+    table.update((variant.casefold(), name) for variant, name in synonyms.items())
+    return table
+
+
+def _closure(roots):
+    """Все теги, достижимые из корней по иерархии, в порядке обхода"""
+    seen = {}
+    stack = list(reversed(roots))
+    while stack:
+        tag = stack.pop()
+        if tag in seen:
+            continue
+        seen[tag] = True
+        stack.extend(reversed(TAG_CHILDREN.get(tag, [])))
+    return list(seen)
+
+
+_TAGS = _lookup(
+    set(TAG_CHILDREN)
+    | {child for children in TAG_CHILDREN.values() for child in children}
+    | {root for roots in CATEGORY_ROOTS.values() for root in roots},
+    TAG_SYNONYMS
+)
+_FORMATS = _lookup(constants.FORMAT_TYPES, FORMAT_SYNONYMS)
+_EVENT_TYPES = _lookup(constants.EVENT_TYPES, EVENT_TYPE_SYNONYMS)
+
+# Замыкание: категория -> все теги под ней
+CATEGORY_CLOSURE = {category: _closure(roots)
+                    for category, roots in CATEGORY_ROOTS.items()}
+_CATEGORIES = {category.casefold(): category for category in CATEGORY_CLOSURE}
+
+
+def _canonical(value, table):
+    value = ' '.join(str(value).split())
+    return table.get(value.casefold(), value)
+
+
+def canonical_tag(tag):
+    """Каноническая форма тега интереса
+
+    Неизвестные теги только нормализуются по пробелам.
+    """
+    return _canonical(tag, _TAGS)
+
+
+def canonical_tags(tags):
+    """Канонические теги без повторов, в исходном порядке"""
+    result = []
+    for tag in tags or []:
+        tag = canonical_tag(tag)
+        if tag and tag not in result:
+            result.append(tag)
+    return result
+
+
+def canonical_format(format_type):
+    return _canonical(format_type, _FORMATS)
+
+
+def canonical_formats(format_types):
+    result = []
+    for format_type in format_types or []:
+        format_type = canonical_format(format_type)
+        if format_type and format_type not in result:
+            result.append(format_type)
+    return result
+
+
+def canonical_event_type(event_type):
+    return _canonical(event_type, _EVENT_TYPES) if event_type else event_type
+
+
+def expand_interests(selected):
+    """Интересы из опроса: категории раскрываются в свои теги, теги канонизируются"""
+    result = []
+    for item in selected or []:
+        category = _CATEGORIES.get(' '.join(str(item).split()).casefold())
+        tags = CATEGORY_CLOSURE[category] if category else [canonical_tag(item)]
+        for tag in tags:
+            if tag and tag not in result:
+                result.append(tag)
+    return result
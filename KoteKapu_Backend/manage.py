@@ -7,6 +7,15 @@ from app import create_app
 app = create_app()
 
 
+def arg_value(name, default=None):
+    """Значение параметра командной строки вида --name value"""
+    if name in sys.argv:
+        index = sys.argv.index(name)
+        if index + 1 < len(sys.argv):
+            return sys.argv[index + 1]
+    return default
+
+
 if __name__ == '__main__':
 
 
@@ -14,6 +23,61 @@ if __name__ == '__main__':
         from app.init_db import init_db
         print('Starting DB initialization...')
         init_db(app)
+    elif '--upgrade-db' in sys.argv:
+        from app.schema import upgrade_schema
+        with app.app_context():
+            upgrade_schema()
+        print("✅ СХЕМА БАЗЫ ДАННЫХ ОБНОВЛЕНА")
+    elif '--repair-counters' in sys.argv:
+        # python manage.py --repair-counters
+        from app.counters import repair_counters
+        with app.app_context():
+            repaired = repair_counters()
+        for column, rows in repaired.items():
+            print(f"   {column}: исправлено {rows}")
+        print("✅ СЧЁТЧИКИ ПЕРЕСЧИТАНЫ")
+    elif '--precompute-feeds' in sys.argv:
+        # python manage.py --precompute-feeds [--processes N] [--depth N]
+        #                                     [--active-only]
+        from app.precompute import precompute_feeds, DEFAULT_DEPTH
+        processes = arg_value('--processes')
+        precompute_feeds(
+            app,
+            processes=int(processes) if processes else None,
+            depth=int(arg_value('--depth', DEFAULT_DEPTH)),
+            active_only='--active-only' in sys.argv
+        )
+    elif '--rebuild-metrics' in sys.argv:
+        # python manage.py --rebuild-metrics [--processes N] [--chunk-size N]
+        #                                    [--checkpoint PATH] [--restart]
+        from app.rebuild import rebuild_metrics, CHUNK_SIZE, DEFAULT_CHECKPOINT
+        processes = arg_value('--processes')
+        rebuild_metrics(
+            app,
+            processes=int(processes) if processes else None,
+            chunk_size=int(arg_value('--chunk-size', CHUNK_SIZE)),
+            checkpoint=arg_value('--checkpoint', DEFAULT_CHECKPOINT),
+            restart='--restart' in sys.argv
+        )
+    elif '--bench-ranking' in sys.argv:
+        # python manage.py --bench-ranking [--user-id N] [--repeat N]
+        from app.bench import bench_ranking
+        user_id = arg_value('--user-id')
+        bench_ranking(
+            app,
+            user_id=int(user_id) if user_id else None,
+            repeat=int(arg_value('--repeat', 20))
+        )
+    elif '--bench-json' in sys.argv:
+        # python manage.py --bench-json [--user-id N] [--limit N] [--repeat N]
+        from app.bench import bench_json
+        user_id = arg_value('--user-id')
+        bench_json(
+            app,
+            user_id=int(user_id) if user_id else None,
+            limit=int(arg_value('--limit', 20)),
+            repeat=int(arg_value('--repeat', 200))
+        )
     else:
         print("🚀 ЗАПУСКАЕМ СЕРВЕР...")
         print("📊 Используем SQLite (app_new.db)")
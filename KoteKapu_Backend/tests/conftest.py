@@ -0,0 +1,98 @@
+"""Общие фикстуры: приложение на временной SQLite-базе и её тестовые данные"""
+
+import itertools
+from datetime import datetime
+
+import pytest
+
+from app import create_app
+from app.extensions import db
+from app.models import Organisation, PostEvent, PostSimple, User
+from app.schema import upgrade_schema
+
+_numbers = itertools.count(1)
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    """Приложение с отдельной базой: рабочая app_new.db не затрагивается"""
+    database = tmp_path_factory.mktemp('db') / 'test.db'
+    # Переменная остаётся на всю сессию: её увидят и процессы пулов,
+    # которые создают своё приложение (например, manage.py --precompute-feeds)
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv('DATABASE_URL', f'sqlite:///{database}')
+        app = create_app()
+        app.config['TESTING'] = True
+        with app.app_context():
+            upgrade_schema()
+        yield app
+
+
+@pytest.fixture
+def make_user(app):
+    """Создаёт пользователя с заданными метриками и возвращает его id"""
+
+    def make(interests=None, formats=None, event_types=None, feed_metrics=None):
+        number = next(_numbers)
+        with app.app_context():
+            user = User(email=f'user{number}@example.com', first_name='Тест',
+                        last_name=f'Пользователь {number}')
+            user.set_password('password123')
+            user.set_interests_metrics(interests or {})
+            user.set_format_metrics(formats or {})
+            user.set_event_type_metrics(event_types or {})
+            if feed_metrics:
+                user.set_feed_metrics(feed_metrics)
+            db.session.add(user)
+            db.session.commit()
+            return user.id
+
+    return make
+
+
+@pytest.fixture
+def organisation(app, make_user):
+    """id новой организации со своим владельцем"""
+    owner_id = make_user()
+    with app.app_context():
+        organisation = Organisation(title=f'Организация {next(_numbers)}',
+                                    description='Тестовая организация',
+                                    owner_id=owner_id)
+        db.session.add(organisation)
+        db.session.commit()
+        return organisation.id
+
+
+@pytest.fixture
+def make_event(app, organisation):
+    """Создаёт мероприятие организации с тегами и возвращает его id"""
+
+    def make(interest_tags=(), format_tags=(), event_type=None):
+        with app.app_context():
+            event = PostEvent(title='Мероприятие', description='Описание',
+                              date_time=datetime(2030, 1, 1, 10, 0),
+                              event_type=event_type, organization_id=organisation)
+            event.set_interest_tags(list(interest_tags))
+            event.set_format_tags(list(format_tags))
+            db.session.add(event)
+            db.session.commit()
+            return event.id
+
+    return make
+
+
+@pytest.fixture
+def make_post(app, organisation):
+    """Создаёт простой пост организации с тегами и возвращает его id"""
+
+    def make(interest_tags=(), format_tags=()):
+        with app.app_context():
+            post = PostSimple(title='Пост', description='Описание',
+                              organization_id=organisation)
+            post.set_interest_tags(list(interest_tags))
+            post.set_format_tags(list(format_tags))
+            db.session.add(post)
+            db.session.commit()
+            return post.id
+
+    return make
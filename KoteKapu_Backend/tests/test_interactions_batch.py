@@ -0,0 +1,42 @@
+"""POST /api/interactions/batch сообщает, обновились ли счётчики ленты"""
+
+from flask_jwt_extended import create_access_token
+
+from app.extensions import db
+from app.metrics_queue import queue as metrics_queue
+from app.models import User
+
+
+def _post_batch(app, user_id, event_id):
+    with app.app_context():
+        token = create_access_token(identity=str(user_id))
+    return app.test_client().post(
+        '/api/interactions/batch',
+        json={'events': [{'post_id': event_id, 'type': 'click'},
+                         {'post_id': event_id, 'type': 'dwell', 'value': 12}]},
+        headers={'Authorization': f'Bearer {token}'})
+
+
+def test_batch_updates_feed_stats(app, make_user, make_event):
+    user_id = make_user()
+    response = _post_batch(app, user_id, make_event(['IT']))
+
+    assert response.status_code == 200
+    assert response.get_json()['accepted'] == 2
+    with app.app_context():
+        feed_metrics = db.session.get(User, user_id).get_feed_metrics()
+    assert feed_metrics['click_rate'] > 0
+    assert feed_metrics['time_spent'] > 0
+
+
+def test_batch_reports_failed_feed_stats(app, make_user, make_event, monkeypatch):
+    def fail(user_id, mutate):
+        raise RuntimeError('database is locked')
+
+    monkeypatch.setattr(metrics_queue, 'update', fail)
+    response = _post_batch(app, make_user(), make_event(['IT']))
+
+    assert response.status_code == 500
+    body = response.get_json()
+    assert body['accepted'] == 2
+    assert body['feed_stats_updated'] is False
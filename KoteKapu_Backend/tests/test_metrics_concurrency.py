@@ -0,0 +1,85 @@
+"""Конкурентные обновления метрик через metrics_queue не теряются"""
+
+import threading
+
+from app import metrics_queue as queue_module
+from app import utils
+from app.extensions import db
+from app.metrics_queue import queue as metrics_queue
+from app.models import PostEvent, User
+
+
+def _metrics(user):
+    return (user.get_interests_metrics(), user.get_format_metrics(),
+            user.get_event_type_metrics(), user.get_feed_metrics())
+
+
+def test_concurrent_likes_are_not_lost(app, make_user, make_event):
+    threads, likes = 8, 25
+    user_id = make_user(interests={'IT': 0.3, 'музыка': 0.1}, formats={'онлайн': 0.5},
+                        event_types={'хакатон': 0.2})
+    event_id = make_event(['IT', 'дизайн'], ['онлайн'], 'хакатон')
+    with app.app_context():
+        user = db.session.get(User, user_id)
+        initial = _metrics(user)
+        initial_version = user.metrics_version
+
+    applied = []
+    signal = ('event', event_id, True, 'like')
+
+    def hammer():
+        with app.app_context():
+            done = sum(metrics_queue.apply(user_id, [signal]) for _ in range(likes))
+            applied.append(done)
+
+    workers = [threading.Thread(target=hammer) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    # Конфликты версий только задерживают запись: каждый лайк применяется
+    assert applied == [likes] * threads
+    total = threads * likes
+
+    with app.app_context():
+        # Те же лайки по одному на копии исходных метрик
+        post = db.session.get(PostEvent, event_id)
+        expected = User()
+        interests, formats, event_types, feed_metrics = initial
+        expected.set_interests_metrics(interests)
+        expected.set_format_metrics(formats)
+        expected.set_event_type_metrics(event_types)
+        expected.set_feed_metrics(feed_metrics)
+        for _ in range(total):
+            utils.update_user_interests(expected, post)
+            expected.update_feed_metrics(post, 'like')
+
+        user = db.session.get(User, user_id)
+        assert _metrics(user) == _metrics(expected)
+        assert user.metrics_version - initial_version == total
+
+
+def test_update_outlasts_retry_budget(app, make_user, monkeypatch):
+    """Запись, проигравшая все оптимистичные попытки, всё равно проходит"""
+    monkeypatch.setattr(queue_module, 'MAX_RETRIES', 2)
+    user_id = make_user(interests={'IT': 1.0})
+    serialized_before = metrics_queue.stats()['serialized']
+    calls = []
+
+    def mutate(user):
+        calls.append(user.metrics_version)
+        if len(calls) <= 4:
+            # Другой воркер успевает записать метрики между чтением и записью
+            with db.engine.begin() as connection:
+                connection.execute(db.update(User).where(User.id == user_id)
+                                   .values(metrics_version=User.metrics_version + 1))
+        user.set_interests_metrics({'IT': 0.5, 'музыка': 0.5})
+
+    with app.app_context():
+        assert metrics_queue.update(user_id, mutate) is True
+        user = db.session.get(User, user_id)
+        assert user.get_interests_metrics() == {'IT': 0.5, 'музыка': 0.5}
+        assert user.metrics_version == 5
+    assert len(calls) == 5
+    assert metrics_queue.stats()['serialized'] - serialized_before == 1
@@ -0,0 +1,50 @@
+"""Затухание весов: давние интересы уступают свежим"""
+
+from datetime import timedelta
+
+import pytest
+
+from app.extensions import db
+from app.metrics_queue import queue as metrics_queue
+from app.models import User
+
+
+def test_old_interests_lose_weight_to_recent_ones(app, make_user, make_event):
+    old_event = make_event(['астрономия'])
+    new_event = make_event(['дизайн'])
+    ratios = {}
+    for days in (0, 30):
+        user_id = make_user()
+        with app.app_context():
+            for _ in range(5):
+                metrics_queue.apply(user_id, [('event', old_event, True, None)])
+            user = db.session.get(User, user_id)
+            user.last_decay_at -= timedelta(days=days)
+            db.session.commit()
+
+            metrics_queue.apply(user_id, [('event', new_event, True, None)])
+            interests = db.session.get(User, user_id).get_interests_metrics()
+            ratios[days] = interests['дизайн'] / interests['астрономия']
+
+    assert ratios[30] > ratios[0]
+
+
+def test_survey_weights_decay_toward_normalized_survey(app, make_user, make_event):
+    event_id = make_event(['астрономия'])
+    user_id = make_user()
+    with app.app_context():
+        user = db.session.get(User, user_id)
+        user.set_survey_metrics({'IT': 1.0, 'музыка': 1.0, 'дизайн': 1.0}, {}, {})
+        db.session.commit()
+        metrics_queue.apply(user_id, [('event', event_id, True, None)])
+
+        user = db.session.get(User, user_id)
+        before = user.get_interests_metrics()
+        user.apply_decay(user.last_decay_at + timedelta(days=30))
+        after = user.get_interests_metrics()
+        db.session.rollback()
+
+    # Анкетные теги возвращаются к своей доле 1/3, а не растут за неё,
+    # свежий лайк за период полураспада теряет половину веса
+    assert before['IT'] < after['IT'] <= 1 / 3
+    assert after['астрономия'] == pytest.approx(before['астрономия'] / 2)
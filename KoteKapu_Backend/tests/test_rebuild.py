@@ -0,0 +1,21 @@
+"""Пересборка метрик не пропускает пользователей с конфликтом версий"""
+
+from app import rebuild
+from app.extensions import db
+from app.models import User
+
+
+def test_conflicted_users_are_rebuilt_again(app, make_user, make_event):
+    user_id = make_user(interests={'IT': 1.0})
+    with app.app_context():
+        _, results, _ = rebuild._rebuild_chunk([user_id])
+        # Живое обновление метрик, пока пачка считалась
+        db.session.execute(db.update(User).where(User.id == user_id)
+                           .values(metrics_version=User.metrics_version + 1))
+        db.session.commit()
+
+        written, retried, unresolved = rebuild._write_with_retries(results)
+        version = db.session.get(User, user_id).metrics_version
+
+    assert (written, retried, unresolved) == (1, 1, [])
+    assert version == results[0][1] + 2